@@ -1,4 +1,5 @@
 import argparse
+import importlib
 import sys
 from typing import Callable
 from typing import List
@@ -10,6 +11,18 @@ from backuppy import __version__
 
 logger = colorlog.getLogger(__name__)
 
+# The parsers for each subcommand are imported lazily, so that we only pay the import cost for the
+# subcommand that's actually being run; each module must define an add_<subcommand>_parser function
+SUBCOMMAND_MODULES = {
+    'backup': 'backuppy.cli.backup',
+    'list': 'backuppy.cli.list',
+    'restore': 'backuppy.cli.restore',
+    'verify': 'backuppy.cli.verify',
+    'get': 'backuppy.cli.get',
+    'put': 'backuppy.cli.put',
+}
+_ROOT_ARGS_WITH_VALUES = ('--log-level', '--log-file', '--log-file-level', '--config')
+
 
 class CustomHelpFormatter(argparse.ArgumentDefaultsHelpFormatter):  # pragma: no cover
     def __init__(self, prog):
@@ -57,6 +70,40 @@ def add_preserve_scratch_arg(parser: argparse.ArgumentParser) -> None:  # pragma
     )
 
 
+def positive_int(value: str) -> int:
+    """ argparse type for options (like --jobs) that must be at least 1
+
+    :param value: the string passed on the command line
+    :returns: the value as an int
+    :raises argparse.ArgumentTypeError: if the value isn't a positive integer
+    """
+    try:
+        ivalue = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid int value: {value!r}')
+    if ivalue < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {ivalue}')
+    return ivalue
+
+
+def _sniff_subcommand(arg_list: List[str]) -> Optional[str]:
+    """ Find the subcommand in the argument list without doing a full parse
+
+    :param arg_list: the command-line arguments passed to the tool
+    :returns: the name of the subcommand, or None if no subcommand was given
+    """
+    skip_next = False
+    for arg in arg_list:
+        if skip_next:
+            skip_next = False
+        elif arg in SUBCOMMAND_MODULES:
+            return arg
+        elif arg.startswith('--') and '=' not in arg and len(arg) > 2:
+            # argparse accepts unambiguous prefixes of long options, so we have to as well
+            skip_next = any(opt.startswith(arg) for opt in _ROOT_ARGS_WITH_VALUES)
+    return None
+
+
 def parse_args(
     description: str,
     arg_list: Optional[List[str]],
@@ -103,20 +150,17 @@ def parse_args(
     subparser = root_parser.add_subparsers(help='accepted commands')
     subparser.dest = 'subcommand'
 
-    from backuppy.cli.backup import add_backup_parser
-    from backuppy.cli.list import add_list_parser
-    from backuppy.cli.restore import add_restore_parser
-    from backuppy.cli.verify import add_verify_parser
-    from backuppy.cli.get import add_get_parser
-    from backuppy.cli.put import add_put_parser
-    add_backup_parser(subparser)
-    add_list_parser(subparser)
-    add_restore_parser(subparser)
-    add_verify_parser(subparser)
-    add_get_parser(subparser)
-    add_put_parser(subparser)
-
-    args = root_parser.parse_args(args=(arg_list or sys.argv[1:]))
+    arg_list = arg_list or sys.argv[1:]
+    subcommand = _sniff_subcommand(arg_list)
+    for command, module_name in SUBCOMMAND_MODULES.items():
+        if command == subcommand:
+            add_parser = getattr(importlib.import_module(module_name), f'add_{command}_parser')
+            add_parser(subparser)
+        else:
+            # the other subcommands just need to show up in the help text
+            subparser.add_parser(command)
+
+    args = root_parser.parse_args(args=arg_list)
 
     if args.subcommand is None:
         logger.error('missing subcommand')
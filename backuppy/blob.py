@@ -1,5 +1,8 @@
+import struct
+from itertools import chain
 from itertools import zip_longest
 from typing import Optional
+from typing import Tuple
 
 import bsdiff4
 import colorlog
@@ -10,15 +13,28 @@ from backuppy.io import IOIter
 
 # This file will read and write diff file for backuppy.
 
-# The expected diff format is '(<len>\|<byte-stream>)*'
+# The expected diff format is '<version>(<prefix><suffix><len><byte-stream>)*'
 #
 # The meaning of these tokens is:
+#  - version: a single byte identifying the diff format (DIFF_FORMAT_VERSION)
+#  - prefix: the number of bytes at the start of the block that are unchanged
+#  - suffix: the number of bytes at the end of the block that are unchanged
 #  - len: the number of bytes in the diff
-#  - byte-stream: a bytes diff returned by bsdiff4
+#  - byte-stream: a bytes diff returned by bsdiff4 for the rest of the block (empty if the block
+#    didn't change)
+#
+# prefix, suffix, and len are all 8-byte big-endian unsigned ints.
+#
+# Older diffs have no version byte and use the format '(<len>\|<byte-stream>)*', where len is
+# an ASCII-encoded decimal number; these always start with a digit, so they can't be confused
+# with a versioned diff, and we can still apply them.
 
 
 logger = colorlog.getLogger(__name__)
+DIFF_FORMAT_VERSION = b'\x01'
+HEADER = struct.Struct('>QQQ')
 SEPARATOR = b'|'
+COMPARE_STRIDE = 1 << 16
 
 
 def apply_diff(orig_file: IOIter, diff_file: IOIter, new_file: IOIter) -> None:
@@ -31,32 +47,45 @@ def apply_diff(orig_file: IOIter, diff_file: IOIter, new_file: IOIter) -> None:
 
     # The outer loop reads a chunk of data at a time; the inner loop parses
     # the read chunk one step at a time and applies it
-    diff = b''
     new_writer = new_file.writer(); next(new_writer)
     orig_reader = orig_file.reader()
     logger.debug2('applying diff')  # type: ignore[attr-defined]
-    for diff_chunk in diff_file.reader():
+
+    # look at the first byte of the diff to figure out which format it's in
+    diff_reader = diff_file.reader()
+    diff = bytearray(next(diff_reader, b''))
+    pos = 0
+    next_frame = _next_legacy_frame
+    if diff[:1] == DIFF_FORMAT_VERSION:
+        next_frame, pos = _next_frame, 1
+
+    for diff_chunk in chain([b''], diff_reader):
+        # drop the data we've already applied, but only once it's more than half of the buffer,
+        # so that we aren't moving the unparsed data around every time we read more
+        if pos > len(diff) // 2:
+            del diff[:pos]
+            pos = 0
         diff += diff_chunk
-        while diff:
-            # try to parse the next chunk; if we can't, break out of the loop to get more data
-            try:
-                diff_len_str, remainder = diff.split(SEPARATOR, 1)
-            except ValueError:
-                break
 
-            diff_len = int(diff_len_str)
-            if len(remainder) < diff_len:
+        while pos < len(diff):
+            # try to parse the next chunk; if we can't, break out of the loop to get more data
+            frame = next_frame(diff, pos)
+            if not frame:
                 break
 
             try:
                 orig_block = next(orig_reader)
             except StopIteration:
                 orig_block = b''
-            new_writer.send(bsdiff4.patch(orig_block, remainder[:diff_len]))
-            diff = remainder[diff_len:]
+            prefix_len, suffix_len, start, pos = frame
+            suffix_start = len(orig_block) - suffix_len
+            new_writer.send(memoryview(orig_block)[:prefix_len])
+            if pos > start:
+                new_writer.send(bsdiff4.patch(orig_block[prefix_len:suffix_start], memoryview(diff)[start:pos]))
+            new_writer.send(memoryview(orig_block)[suffix_start:])
 
-    if diff:
-        raise DiffParseError(f'Un-parseable diff: {diff}')  # type: ignore
+    if pos < len(diff):
+        raise DiffParseError(f'Un-parseable diff: {bytes(diff[pos:])}')  # type: ignore
 
 
 def compute_diff(
@@ -73,15 +102,112 @@ def compute_diff(
     """
 
     total_written = 0
+    max_diff_size = orig_file.size * discard_diff_percentage if discard_diff_percentage else None
 
     writer = diff_file.writer(); next(writer)
+    writer.send(DIFF_FORMAT_VERSION)
     logger.debug2('beginning diff computation')  # type: ignore[attr-defined]
     for orig_bytes, new_bytes in zip_longest(orig_file.reader(), new_file.reader(), fillvalue=b''):
-        diff = bsdiff4.diff(orig_bytes, new_bytes)
-        diff_str = str(len(diff)).encode() + SEPARATOR + diff
-        total_written += len(diff_str)
-        if discard_diff_percentage and total_written > orig_file.size * discard_diff_percentage:
+        # Most of the blocks in a changed file are usually the same as before, and checking that
+        # is a single memcmp; those blocks are stored as an empty diff with the whole block as prefix
+        if orig_bytes == new_bytes:
+            prefix_len, suffix_len, diff = len(orig_bytes), 0, b''
+        else:
+            # bsdiff has to index the entire original block, so only hand it the part that changed
+            prefix_len = _common_prefix_len(orig_bytes, new_bytes)
+            suffix_len = _common_suffix_len(orig_bytes, new_bytes, prefix_len)
+            diff = bsdiff4.diff(
+                orig_bytes[prefix_len:len(orig_bytes) - suffix_len],
+                new_bytes[prefix_len:len(new_bytes) - suffix_len],
+            )
+        total_written += HEADER.size + len(diff)
+        if max_diff_size is not None and total_written > max_diff_size:
             raise DiffTooLargeException
-        writer.send(diff_str)
+        writer.send(HEADER.pack(prefix_len, suffix_len, len(diff)))
+        writer.send(diff)
 
     return diff_file
+
+
+def _common_prefix_len(orig_bytes: bytes, new_bytes: bytes) -> int:
+    """ Count the bytes at the start of two blocks that are the same; we compare large slices at
+    a time and then narrow down on the first difference.  Each comparison copies both slices
+    before doing a memcmp, but that's still much faster than comparing memoryview slices, which
+    CPython does one element at a time
+
+    :param orig_bytes: the "original" block
+    :param new_bytes: the "new" block
+    :returns: the length of the common prefix
+    """
+    max_len = min(len(orig_bytes), len(new_bytes))
+    common_len, stride = 0, COMPARE_STRIDE
+    while common_len + stride <= max_len and \
+            orig_bytes[common_len:common_len + stride] == new_bytes[common_len:common_len + stride]:
+        common_len += stride
+
+    while stride > 1:
+        stride //= 2
+        if common_len + stride <= max_len and \
+                orig_bytes[common_len:common_len + stride] == new_bytes[common_len:common_len + stride]:
+            common_len += stride
+    return common_len
+
+
+def _common_suffix_len(orig_bytes: bytes, new_bytes: bytes, prefix_len: int) -> int:
+    """ Count the bytes at the end of two blocks that are the same, without overlapping the
+    common prefix; see _common_prefix_len
+
+    :param orig_bytes: the "original" block
+    :param new_bytes: the "new" block
+    :param prefix_len: the length of the common prefix of the blocks
+    :returns: the length of the common suffix
+    """
+    max_len = min(len(orig_bytes), len(new_bytes)) - prefix_len
+    orig_end, new_end = len(orig_bytes), len(new_bytes)
+    common_len, stride = 0, COMPARE_STRIDE
+    while common_len + stride <= max_len and \
+            orig_bytes[orig_end - common_len - stride:orig_end - common_len] == \
+            new_bytes[new_end - common_len - stride:new_end - common_len]:
+        common_len += stride
+
+    while stride > 1:
+        stride //= 2
+        if common_len + stride <= max_len and \
+                orig_bytes[orig_end - common_len - stride:orig_end - common_len] == \
+                new_bytes[new_end - common_len - stride:new_end - common_len]:
+            common_len += stride
+    return common_len
+
+
+def _next_frame(diff: bytearray, pos: int) -> Optional[Tuple[int, int, int, int]]:
+    """ Find the next frame in a diff
+
+    :param diff: the unparsed diff data
+    :param pos: the offset in the diff where the next frame starts
+    :returns: a tuple of (common prefix length, common suffix length, start, end), where start
+        and end are the offsets of the bsdiff data; or None if we need more data
+    """
+    start = pos + HEADER.size
+    if len(diff) < start:
+        return None
+
+    prefix_len, suffix_len, diff_len = HEADER.unpack_from(diff, pos)
+    end = start + diff_len
+    return (prefix_len, suffix_len, start, end) if len(diff) >= end else None
+
+
+def _next_legacy_frame(diff: bytearray, pos: int) -> Optional[Tuple[int, int, int, int]]:
+    """ Find the next frame in an old-style (unversioned) diff; these never have a common prefix
+    or suffix
+
+    :param diff: the unparsed diff data
+    :param pos: the offset in the diff where the next frame starts
+    :returns: a tuple of (0, 0, start, end), or None if we need more data
+    """
+    separator_pos = diff.find(SEPARATOR, pos)
+    if separator_pos == -1:
+        return None
+
+    start = separator_pos + 1
+    end = start + int(diff[pos:separator_pos])
+    return (0, 0, start, end) if len(diff) >= end else None
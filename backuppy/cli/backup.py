@@ -1,5 +1,10 @@
 import argparse
 import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Dict
 from typing import List
 from typing import Pattern
 from typing import Set
@@ -9,6 +14,7 @@ import staticconf
 
 from backuppy.args import add_name_arg
 from backuppy.args import add_preserve_scratch_arg
+from backuppy.args import positive_int
 from backuppy.args import subparser
 from backuppy.stores import get_backup_store
 from backuppy.stores.backup_store import BackupStore
@@ -16,6 +22,8 @@ from backuppy.util import compile_exclusions
 from backuppy.util import file_walker
 
 logger = colorlog.getLogger(__name__)
+# how many files each worker can have waiting in the queue before we stop walking the filesystem
+QUEUED_FILES_PER_JOB = 4
 
 
 def _scan_directory(
@@ -23,14 +31,18 @@ def _scan_directory(
     backup_store: BackupStore,
     exclusions: List[Pattern],
     dry_run: bool,
+    jobs: int = 1,
 ) -> Set[str]:
     """ scan a directory looking for changes from the manifest
 
     :param abs_base_path: the root of the directory to scan
     :param backup_store: the BackupStore object that should be used to back up the directory
     :param exclusions: a list of files to ignore during backup
+    :param jobs: the number of files to back up in parallel
     """
-    backup_store.manifest.files()
+    if jobs > 1:
+        return _scan_directory_parallel(abs_base_path, backup_store, exclusions, dry_run, jobs)
+
     marked_files = set()
     for abs_file_name in file_walker(abs_base_path, on_error=logger.warning, exclusions=exclusions):
 
@@ -50,6 +62,48 @@ def _scan_directory(
     return marked_files
 
 
+def _scan_directory_parallel(
+    abs_base_path: str,
+    backup_store: BackupStore,
+    exclusions: List[Pattern],
+    dry_run: bool,
+    jobs: int,
+) -> Set[str]:
+    """ Same as _scan_directory, but back up multiple files at once; hashing, compression,
+    encryption, and talking to the backup store all release the GIL, so threads are good enough
+    """
+    marked_files = set()
+    max_queued = jobs * QUEUED_FILES_PER_JOB
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures: Dict[Future, str] = {}
+        for abs_file_name in file_walker(abs_base_path, on_error=logger.warning, exclusions=exclusions):
+            marked_files.add(abs_file_name)
+            futures[executor.submit(backup_store.save_if_new, abs_file_name, dry_run=dry_run)] = abs_file_name
+
+            # Don't let the walk get too far ahead of the workers, otherwise we queue up a future
+            # for every file in the directory tree before we've backed any of them up
+            if len(futures) >= max_queued:
+                done, __ = wait(futures, return_when=FIRST_COMPLETED)
+                _check_results(done, futures)
+
+        _check_results(wait(futures).done, futures)
+    finally:
+        # if we're shutting down early (e.g., from a signal), don't start any more work
+        executor.shutdown(cancel_futures=True)
+
+    return marked_files
+
+
+def _check_results(done: Set[Future], futures: Dict[Future, str]) -> None:
+    for future in done:
+        abs_file_name = futures.pop(future)
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception(f'There was a problem backing up {abs_file_name}: {str(e)}; skipping')
+
+
 def main(args: argparse.Namespace) -> None:
     """ entry point for the 'backup' subcommand """
     if args.dry_run:
@@ -59,22 +113,24 @@ def main(args: argparse.Namespace) -> None:
 
     with backup_store.unlock(dry_run=args.dry_run, preserve_scratch=args.preserve_scratch_dir):
         marked_files: Set[str] = set()
+        exclusions = compile_exclusions(
+            staticconf.read_list('exclusions', [], namespace=args.name)  # type: ignore[attr-defined]
+        )
         for base_path in staticconf.read_list('directories', namespace=args.name):  # type: ignore[attr-defined]
             abs_base_path = os.path.abspath(base_path)
-            exclusions = compile_exclusions(
-                staticconf.read_list('exclusions', [], namespace=args.name)  # type: ignore[attr-defined]
-            )
-            marked_files |= _scan_directory(
+            marked_files.update(_scan_directory(
                 abs_base_path,
                 backup_store,
                 exclusions,
                 args.dry_run,
-            )
+                args.jobs,
+            ))
 
-        for abs_file_name in backup_store.manifest.files() - marked_files:
+        deleted_files = backup_store.manifest.files(exclude=marked_files)
+        for abs_file_name in deleted_files:
             logger.info(f'{abs_file_name} has been deleted')
-            if not args.dry_run:
-                backup_store.manifest.delete(abs_file_name)
+        if not args.dry_run:
+            backup_store.manifest.delete_many(deleted_files)
     logger.info(f'Backup for {args.name} finished')
 
 
@@ -85,5 +141,11 @@ def add_backup_parser(subparser) -> None:  # pragma: no cover
         action='store_true',
         help='Only print what would happen, do not perform any actions',
     )
+    subparser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=1,
+        help='Number of files to back up in parallel',
+    )
     add_name_arg(subparser)
     add_preserve_scratch_arg(subparser)
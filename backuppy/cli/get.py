@@ -1,4 +1,5 @@
 import argparse
+import heapq
 
 from backuppy.args import add_name_arg
 from backuppy.args import subparser
@@ -56,7 +57,12 @@ def main(args: argparse.Namespace) -> None:
         else:
             # Retrieve the manifest instead of a specific file; we don't call unlock_manifest
             # here so that we can have control over the action
-            filename = sorted(backup_store._query(MANIFEST_PREFIX), reverse=True)[args.manifest]
+            # only keep as many manifests as we need to index into, instead of sorting all of them
+            manifests = backup_store._query(MANIFEST_PREFIX)
+            if args.manifest >= 0:
+                filename = heapq.nlargest(args.manifest + 1, manifests)[args.manifest]
+            else:
+                filename = heapq.nsmallest(-args.manifest, manifests)[-args.manifest - 1]
             filename = filename.removeprefix('/')
             private_key_filename = backup_store.config.read('private_key_filename', default='')
             key_pair = get_manifest_keypair(filename, private_key_filename, backup_store._load)
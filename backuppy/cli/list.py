@@ -2,6 +2,7 @@ import argparse
 import os
 import stat
 import time
+from itertools import groupby
 from typing import List
 from typing import Tuple
 
@@ -20,63 +21,58 @@ SUMMARY_HEADERS: List[str] = ['filename', 'versions', 'del?', 'last backup time'
 DETAILS_HEADERS: List[str] = ['sha', 'uid', 'gid', 'permissions', 'backup time']
 
 
-def _split_root_prefix(abs_file_name: str, backup_name: str) -> Tuple[str, str]:
-    for directory in staticconf.read_list('directories', namespace=backup_name):  # type: ignore[attr-defined]
-        abs_root = os.path.abspath(directory) + os.path.sep
+def _get_abs_roots(backup_name: str) -> List[str]:
+    return [
+        os.path.abspath(directory) + os.path.sep
+        for directory in staticconf.read_list('directories', namespace=backup_name)  # type: ignore[attr-defined]
+    ]
+
+
+def _split_root_prefix(abs_file_name: str, abs_roots: List[str]) -> Tuple[str, str]:
+    for abs_root in abs_roots:
         if abs_file_name.startswith(abs_root):
             return abs_root, abs_file_name[len(abs_root):]
     raise ValueError(f'{abs_file_name} does not start with any directory prefix')
 
 
-def _print_summary(
-    backup_name: str,
-    search_results: List[QueryResponse],
-    deleted_only: bool,
-    changed_only: bool,
-) -> None:
-    contents: List[Tuple[str, int, str, str]] = []
-
-    for i, (abs_file_name, history) in enumerate(search_results):
-        root_directory, filename = _split_root_prefix(search_results[i][0], backup_name)
-        backup_time_str = format_time(history[0].commit_timestamp)
-        deleted_str = '' if history[0].sha else 'y'
-
-        # If the deleted_only flag is present and the SHA is not None, this file _wasn't_
-        # deleted, so don't show it.  Similarly, if the changed_only flag is present and the
-        # history length is 1, don't show it.  A file has to have a history of at least 2 if
-        # it's been deleted so these can be present in the same check.
-        if (not (deleted_only and history[0].sha)) and (not changed_only or len(history) > 1):
-            contents.append((filename, len(history), deleted_str, backup_time_str))
-
-        if i == len(search_results) - 1 or not search_results[i+1][0].startswith(root_directory):
-            print(f'\n{DASHES}\n{root_directory}\n{DASHES}')
-            print(tabulate(contents, headers=SUMMARY_HEADERS))
-            if i != len(search_results) - 1:
-                contents = []
+def _print_summary(backup_name: str, search_results: List[QueryResponse]) -> None:
+    abs_roots = _get_abs_roots(backup_name)
+
+    # search results are sorted by filename, so all the files under a root directory are adjacent
+    grouped_results = groupby(search_results, key=lambda result: _split_root_prefix(result[0], abs_roots)[0])
+    for root_directory, results in grouped_results:
+        contents = (
+            (
+                abs_file_name[len(root_directory):],
+                len(history),
+                '' if history[0].sha else 'y',
+                format_time(history[0].commit_timestamp),
+            )
+            for abs_file_name, history in results
+        )
+        print(f'\n{DASHES}\n{root_directory}\n{DASHES}')
+        print(tabulate(contents, headers=SUMMARY_HEADERS))
     print('')
 
 
 def _print_details(
     backup_name: str,
     search_results: List[QueryResponse],
-    deleted_only: bool,
-    changed_only: bool,
     sha_length: int,
 ) -> None:
     for abs_file_name, history in search_results:
-        if (not (deleted_only and history[0].sha)) and (not changed_only or len(history) > 1):
-            contents = [
-                (
-                    format_sha(h.sha, sha_length),
-                    h.uid,
-                    h.gid,
-                    (stat.filemode(h.mode) if h.mode else '<deleted>'),
-                    format_time(h.commit_timestamp),
-                )
-                for h in history
-            ]
-            print(f'\n{DASHES}\n{abs_file_name}\n{DASHES}')
-            print(tabulate(contents, headers=DETAILS_HEADERS))
+        contents = (
+            (
+                format_sha(h.sha, sha_length),
+                h.uid,
+                h.gid,
+                (stat.filemode(h.mode) if h.mode else '<deleted>'),
+                format_time(h.commit_timestamp),
+            )
+            for h in history
+        )
+        print(f'\n{DASHES}\n{abs_file_name}\n{DASHES}')
+        print(tabulate(contents, headers=DETAILS_HEADERS))
     print('')
 
 
@@ -92,11 +88,13 @@ def main(args: argparse.Namespace) -> None:
             file_limit=args.file_limit,
             history_limit=args.history_limit,
             like=args.like,
+            deleted_only=args.deleted,
+            changed_only=args.changed,
         )
     if not args.details:
-        _print_summary(args.name, search_results, args.deleted, args.changed)
+        _print_summary(args.name, search_results)
     else:
-        _print_details(args.name, search_results, args.deleted, args.changed, args.sha_length)
+        _print_details(args.name, search_results, args.sha_length)
 
 
 @subparser('list', 'list the contents of a backup set', main)
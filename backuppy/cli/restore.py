@@ -1,6 +1,8 @@
 import argparse
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -9,6 +11,7 @@ import staticconf
 from tabulate import tabulate
 
 from backuppy.args import add_preserve_scratch_arg
+from backuppy.args import positive_int
 from backuppy.args import subparser
 from backuppy.io import IOIter
 from backuppy.manifest import ManifestEntry
@@ -46,13 +49,15 @@ def _confirm_restore(
             'Files in this location may be overwritten.'
         )
     print(f'Backuppy will restore the following files to {destination_str}:\n')
-    print(tabulate([
-        [
-            f.abs_file_name,
-            format_sha(f.sha, SHA_LENGTH),
-            format_time(f.commit_timestamp),
-        ]
-        for f in files_to_restore],
+    print(tabulate(
+        (
+            (
+                f.abs_file_name,
+                format_sha(f.sha, SHA_LENGTH),
+                format_time(f.commit_timestamp),
+            )
+            for f in files_to_restore
+        ),
         headers=RESTORE_LIST_HEADERS,
     ))
     print('')
@@ -63,21 +68,45 @@ def _restore(
     files_to_restore: List[ManifestEntry],
     destination: str,
     backup_store: BackupStore,
+    jobs: int = 1,
 ) -> None:
+    """ Restore a list of files from the backup store
+
+    :param files_to_restore: the manifest entries to restore
+    :param destination: the directory to restore the files into
+    :param backup_store: the BackupStore object to restore the files from
+    :param jobs: the number of files to restore in parallel
+    """
     print('Beginning restore...')
     os.makedirs(destination, exist_ok=True)
-    for f in files_to_restore:
-        stripped_abs_file_name = f.abs_file_name.removeprefix('/').replace(':', '')
-        restore_file_name = path_join(destination, stripped_abs_file_name)
-
-        with IOIter() as orig_file, \
-                IOIter() as diff_file, \
-                IOIter(restore_file_name) as restore_file:
-            backup_store.restore_entry(f, orig_file, diff_file, restore_file)
+    if jobs > 1:
+        # loading from the store, decryption, and decompression all release the GIL, so threads
+        # are good enough here
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            restore_fn = partial(_restore_file, destination=destination, backup_store=backup_store)
+            for _ in executor.map(restore_fn, files_to_restore):
+                pass
+        finally:
+            # if one of the files failed, don't start restoring any more of them
+            executor.shutdown(cancel_futures=True)
+    else:
+        for f in files_to_restore:
+            _restore_file(f, destination, backup_store)
 
     print('Restore complete!\n')
 
 
+def _restore_file(entry: ManifestEntry, destination: str, backup_store: BackupStore) -> None:
+    stripped_abs_file_name = entry.abs_file_name.removeprefix('/').replace(':', '')
+    restore_file_name = path_join(destination, stripped_abs_file_name)
+
+    with IOIter() as orig_file, \
+            IOIter() as diff_file, \
+            IOIter(restore_file_name) as restore_file:
+        backup_store.restore_entry(entry, orig_file, diff_file, restore_file)
+
+
 def main(args: argparse.Namespace) -> None:
     staticconf.DictConfiguration({'yes': args.yes})
     destination, destination_str = _parse_destination(args.dest, args.name)
@@ -102,7 +131,7 @@ def main(args: argparse.Namespace) -> None:
             files_to_restore = [h[0] for _, h in search_results if h[0].sha]
 
         if _confirm_restore(files_to_restore, destination, destination_str):
-            _restore(files_to_restore, destination, backup_store)
+            _restore(files_to_restore, destination, backup_store, args.jobs)
 
 
 @subparser('restore', 'restore files from a backup set', main)
@@ -133,6 +162,12 @@ def add_restore_parser(subparser) -> None:  # pragma: no cover
         default='.',
         help='Location to restore the file(s) to'
     )
+    subparser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=1,
+        help='Number of files to restore in parallel',
+    )
     subparser.add_argument(
         '-y', '--yes',
         action='store_true',
@@ -1,16 +1,23 @@
 import argparse
 import os.path
 from collections import defaultdict
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Deque
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 
 import colorlog
 import staticconf
 
 from backuppy.args import add_preserve_scratch_arg
+from backuppy.args import positive_int
 from backuppy.args import subparser
 from backuppy.exceptions import MismatchedSHAError
-from backuppy.io import compute_sha
 from backuppy.io import IOIter
 from backuppy.manifest import ManifestEntry
 from backuppy.stores import get_backup_store
@@ -18,6 +25,8 @@ from backuppy.stores.backup_store import BackupStore
 from backuppy.util import ask_for_confirmation
 
 logger = colorlog.getLogger(__name__)
+# how many entries each worker can check ahead of the ones we've reported on
+QUEUED_ENTRIES_PER_JOB = 4
 
 
 def _check_entry(entry: ManifestEntry, backup_store: BackupStore):
@@ -25,26 +34,28 @@ def _check_entry(entry: ManifestEntry, backup_store: BackupStore):
             IOIter() as diff_file, \
             IOIter() as restore_file:
 
+        # the restored data is hashed as it's written, so we don't have to read it back in again
         backup_store.restore_entry(entry, orig_file, diff_file, restore_file)
-        sha = compute_sha(restore_file)
+        sha = restore_file.sha()
         if sha != entry.sha:
             raise MismatchedSHAError(f'SHAs for {entry.abs_file_name} do not match')
 
 
 def _fix_duplicate_entries(backup_store: BackupStore):
     print('Checking for duplicate entries...')
-    entries = backup_store.manifest.find_duplicate_entries()
-    grouped_entries = defaultdict(list)
-    for e in entries:
-        grouped_entries[(e.abs_file_name, e.sha, e.uid, e.gid, e.mode)].append(e)
-
-    for (filename, sha, _, _, _), entries in grouped_entries.items():
+    # the manifest hands back the duplicates already grouped together, newest first
+    grouped_entries = groupby(
+        backup_store.manifest.find_duplicate_entries(),
+        key=lambda e: (e.abs_file_name, e.sha, e.uid, e.gid, e.mode),
+    )
+    for (filename, sha, _, _, _), group in grouped_entries:
+        entries = list(group)
         print(
             f'ERROR: Found {len(entries)} duplicate entries for ({filename}, {sha}), '
             'trying to clean up...'
         )
         found_good_entry = False
-        for entry in sorted(entries, key=lambda e: e.commit_timestamp, reverse=True):
+        for entry in entries:
             if not found_good_entry:
                 try:
                     _check_entry(entry, backup_store)
@@ -102,36 +113,71 @@ def _fix_shas_with_multiple_key_pairs(backup_store: BackupStore):
     print('Multiple key-pair check complete!\n')
 
 
-def _verify(entries: List[ManifestEntry], backup_store: BackupStore, show_all: bool) -> None:
+def _verify(
+    entries: List[ManifestEntry],
+    backup_store: BackupStore,
+    show_all: bool,
+    jobs: int = 1,
+) -> None:
     print('Beginning verification...')
 
     # Because we might be fixing things as we go, we need to keep track of what
     # we've fixed so we don't needlessly overwrite data
     fixed_shas: Dict[str, bytes] = dict()
-    for entry in entries:
 
-        check_str = f'Checking {entry.abs_file_name}...'
+    def check(entry: ManifestEntry) -> Optional[Exception]:
         if entry.sha in fixed_shas:
             entry.key_pair = fixed_shas[entry.sha]
         if entry.base_sha in fixed_shas:
             entry.base_key_pair = fixed_shas[entry.base_sha]
 
-        verified = False
         try:
             _check_entry(entry, backup_store)
-            verified = True
-            check_str += ' OK!'
         except Exception as e:
-            check_str += f' ERROR: {str(e)}'
+            return e
+        return None
+
+    def report(entry: ManifestEntry, error: Optional[Exception]) -> None:
+        # a background check might have run before we fixed the data it depends on
+        if error and (entry.sha in fixed_shas or entry.base_sha in fixed_shas):
+            error = check(entry)
 
-        if not verified or show_all:
+        check_str = f'Checking {entry.abs_file_name}...'
+        check_str += f' ERROR: {str(error)}' if error else ' OK!'
+        if error or show_all:
             print(check_str)
 
-        if not verified and ask_for_confirmation('Backed up file is corrupt; fix?'):
+        if error and ask_for_confirmation('Backed up file is corrupt; fix?'):
             new_entry = backup_store.save_if_new(entry.abs_file_name, force_copy=True)
             if new_entry:
                 fixed_shas[new_entry.sha] = new_entry.key_pair
 
+    if jobs > 1:
+        # Each entry can be checked independently, so with multiple jobs we check them in the background
+        # (loading, decryption, and hashing all release the GIL); the results are reported in order, and
+        # all of the printing and fixing happens here so that the prompts don't get interleaved
+        max_queued = jobs * QUEUED_ENTRIES_PER_JOB
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            queued: Deque[Tuple[ManifestEntry, Future]] = deque()
+            for entry in entries:
+                queued.append((entry, executor.submit(check, entry)))
+
+                # Don't let the workers get too far ahead of us, since we might be waiting on the user
+                # to answer a prompt for one of the earlier entries
+                if len(queued) >= max_queued:
+                    queued_entry, future = queued.popleft()
+                    report(queued_entry, future.result())
+
+            while queued:
+                queued_entry, future = queued.popleft()
+                report(queued_entry, future.result())
+        finally:
+            executor.shutdown(cancel_futures=True)
+    else:
+        for entry in entries:
+            report(entry, check(entry))
+
     print('Verification complete!\n')
 
 
@@ -165,7 +211,7 @@ def main(args: argparse.Namespace) -> None:
             # Verify the most recent version of all files that haven't been deleted
             files_to_verify = [h[0] for _, h in search_results if h[0].sha]
 
-        _verify(files_to_verify, backup_store, args.show_all)
+        _verify(files_to_verify, backup_store, args.show_all, args.jobs)
 
 
 @subparser('verify', 'verify file integrity in a backup set', main)
@@ -201,4 +247,10 @@ def add_verify_parser(subparser) -> None:  # pragma: no cover
         action='store_true',
         help='Quick verification (just check manifest for consistency)'
     )
+    subparser.add_argument(
+        '-j', '--jobs',
+        type=positive_int,
+        default=1,
+        help='Number of files to verify in parallel',
+    )
     add_preserve_scratch_arg(subparser)
@@ -1,12 +1,10 @@
 import os
 import zlib
 from itertools import chain
-from itertools import repeat
 from typing import Callable
 from typing import cast
 from typing import Generator
 from typing import Optional
-from typing import Tuple
 
 import colorlog
 from cryptography.exceptions import InvalidSignature
@@ -15,12 +13,14 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
 from cryptography.hazmat.primitives.ciphers import Cipher
+from cryptography.hazmat.primitives.ciphers import CipherContext
 from cryptography.hazmat.primitives.ciphers.algorithms import AES
 from cryptography.hazmat.primitives.ciphers.modes import CTR
 from cryptography.hazmat.primitives.hashes import SHA256
 from cryptography.hazmat.primitives.hmac import HMAC
 
 from backuppy.exceptions import BackupCorruptedError
+from backuppy.io import io_copy
 from backuppy.io import IOIter
 from backuppy.options import OptionsDict
 
@@ -35,6 +35,25 @@ def identity(x: bytes) -> bytes:
     return x
 
 
+def _update_into_fn(cipher_ctx: CipherContext) -> Callable[[bytes], memoryview]:
+    """ Wrap a cipher's update function so that every call writes into the same output buffer,
+    instead of allocating a new bytes object for each block; AES-CTR output is the same length as
+    the input, so the buffer only has to be reallocated if we're handed a bigger block than before
+
+    :param cipher_ctx: the encryptor or decryptor to wrap
+    :returns: an update function whose result is only valid until the next time it's called
+    """
+    buf = bytearray()
+
+    def update(data: bytes) -> memoryview:
+        nonlocal buf
+        # update_into requires AES_BLOCK_SIZE - 1 bytes of extra space in the output buffer
+        if len(buf) < len(data) + AES_BLOCK_SIZE - 1:
+            buf = bytearray(len(data) + AES_BLOCK_SIZE - 1)
+        return memoryview(buf)[:cipher_ctx.update_into(data, buf)]
+    return update
+
+
 def compress_and_encrypt(
     input_file: IOIter,
     output_file: IOIter,
@@ -47,33 +66,41 @@ def compress_and_encrypt(
     :param input_file: an IOIter object to read plaintext data from
     :param output_file: an IOIter object to write compressed ciphertext to
     """
+    use_compression, use_encryption = options['use_compression'], options['use_encryption']
+    if not use_compression and not use_encryption:
+        # nothing to do to the data, so we can just copy it straight over
+        io_copy(input_file, output_file)
+        return b''
+
     key, nonce = (key_pair[:AES_KEY_SIZE], key_pair[AES_KEY_SIZE:]) if key_pair else (b'', b'')
-    compressobj = zlib.compressobj()
+    # lower compression levels are much faster, at the cost of a (usually small) hit to the compression
+    # ratio; any level can be read back by decrypt_and_unpack, so this can be changed at any time
+    compressobj = zlib.compressobj(options.get('compression_level', zlib.Z_DEFAULT_COMPRESSION))
     zip_fn: Callable[[bytes], bytes] = (  # type: ignore
-        compressobj.compress if options['use_compression'] else identity
+        compressobj.compress if use_compression else identity
     )
     encrypt_fn: Callable[[bytes], bytes] = (
-        Cipher(AES(key), CTR(nonce), backend=default_backend()).encryptor().update
-        if options['use_encryption'] else identity
+        _update_into_fn(Cipher(AES(key), CTR(nonce), backend=default_backend()).encryptor())
+        if use_encryption else identity
     )
     hmac = HMAC(key, SHA256(), default_backend())
 
-    def last_block() -> Generator[Tuple[bytes, bool], None, None]:
-        yield (compressobj.flush(), False) if options['use_compression'] else (b'', False)
+    def last_block() -> Generator[bytes, None, None]:
+        # this has to be lazy, since we can't flush the compressor until it's seen all of the data
+        if use_compression:
+            yield compressobj.flush()
 
     writer = output_file.writer(); next(writer)
     logger.debug2('starting to compress')  # type: ignore[attr-defined]
-    for block, needs_compression in chain(zip(input_file.reader(), repeat(True)), last_block()):
-        if needs_compression:
-            block = zip_fn(block)
-        logger.debug2(f'zip_fn returned {len(block)} bytes')  # type: ignore[attr-defined]
+    for block in chain(map(zip_fn, input_file.buffered_reader()), last_block()):
+        logger.debug2('zip_fn returned %d bytes', len(block))  # type: ignore[attr-defined]
         block = encrypt_fn(block)
-        logger.debug2(f'encrypt_fn returned {len(block)} bytes')  # type: ignore[attr-defined]
-        if options['use_encryption']:
+        logger.debug2('encrypt_fn returned %d bytes', len(block))  # type: ignore[attr-defined]
+        if use_encryption:
             hmac.update(block)
         writer.send(block)
 
-    if options['use_encryption']:
+    if use_encryption:
         return hmac.finalize()
     else:
         return b''
@@ -91,42 +118,42 @@ def decrypt_and_unpack(
     :param input_file: an IOIter object to read compressed ciphertext from
     :param output_file: an IOIter object to write plaintext data to
     """
+    use_compression, use_encryption = options['use_compression'], options['use_encryption']
+    if not use_compression and not use_encryption:
+        # the data was stored as-is, so we can just copy it straight over
+        io_copy(input_file, output_file)
+        return
+
     key, nonce, signature = (
         key_pair[:AES_KEY_SIZE],
         key_pair[AES_KEY_SIZE:AES_KEY_SIZE + AES_BLOCK_SIZE],
         key_pair[AES_KEY_SIZE + AES_BLOCK_SIZE:]
     ) if key_pair else (b'', b'', b'')
-    decrypted_data = b''
     decrypt_fn: Callable[[bytes], bytes] = (
-        Cipher(AES(key), CTR(nonce), backend=default_backend()).decryptor().update
-        if options['use_encryption'] else identity
+        _update_into_fn(Cipher(AES(key), CTR(nonce), backend=default_backend()).decryptor())
+        if use_encryption else identity
     )
     decompress_obj = zlib.decompressobj()
     unzip_fn: Callable[[bytes], bytes] = (
         decompress_obj.decompress  # type: ignore
-        if options['use_compression'] else identity
+        if use_compression else identity
     )
     hmac = HMAC(key, SHA256(), default_backend())
     writer = output_file.writer(); next(writer)
-    for encrypted_data in input_file.reader():
-        if options['use_encryption']:
+    for encrypted_data in input_file.buffered_reader():
+        if use_encryption:
             hmac.update(encrypted_data)
-        decrypted_data += decrypt_fn(encrypted_data)
-        logger.debug2(f'decrypt_fn returned {len(decrypted_data)} bytes')  # type: ignore[attr-defined]
-
-        block = unzip_fn(decrypted_data)
-        logger.debug2(f'unzip_fn returned {len(block)} bytes')  # type: ignore[attr-defined]
-        writer.send(block)
-        decrypted_data = decompress_obj.unused_data
+        decrypted_data = decrypt_fn(encrypted_data)
+        logger.debug2('decrypt_fn returned %d bytes', len(decrypted_data))  # type: ignore[attr-defined]
 
-    # Decompress and write out the last block
-    if decrypted_data:
+        # once the zlib stream has ended, the decompressor just ignores anything else we give it (it
+        # gets stashed in decompress_obj.unused_data), so there's no leftover data to handle
         block = unzip_fn(decrypted_data)
-        logger.debug2(f'unzip_fn returned {len(block)} bytes')  # type: ignore[attr-defined]
+        logger.debug2('unzip_fn returned %d bytes', len(block))  # type: ignore[attr-defined]
         writer.send(block)
 
     try:
-        if options['use_encryption']:
+        if use_encryption:
             hmac.verify(signature)
     except InvalidSignature as e:
         raise BackupCorruptedError("The file's signature did not match the data") from e
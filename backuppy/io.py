@@ -12,9 +12,17 @@ import colorlog
 from backuppy.exceptions import DoubleBufferError
 from backuppy.exceptions import FileChangedException
 
+try:
+    from hashlib import file_digest
+except ImportError:  # pragma: no cover
+    file_digest = None  # type: ignore[assignment]  # only available in Python 3.11+
+
 logger = colorlog.getLogger(__name__)
 BLOCK_SIZE = (1 << 30)  # 1GB block size
+STREAM_BUFFER_SIZE = (1 << 20)  # 1MB buffer for data that doesn't need to be read a whole block at a time
 O_BINARY = getattr(os, 'O_BINARY', 0x0)  # O_BINARY only available on windows
+POSIX_FADV_SEQUENTIAL = getattr(os, 'POSIX_FADV_SEQUENTIAL', None)  # fadvise only available on unix
+POSIX_FADV_DONTNEED = getattr(os, 'POSIX_FADV_DONTNEED', None)
 
 
 class IOIter:
@@ -40,6 +48,11 @@ class IOIter:
         self._should_check_mtime = check_mtime
         self._enter_mtime: Optional[int] = None
 
+        # Set this before the last time a file is read to tell the kernel that we're done with each
+        # block as we go, so that a big backup doesn't push everything else out of the page cache;
+        # it's off by default since most files (especially scratch files) get read more than once
+        self.drop_cache_after_read = False
+
     def __enter__(self) -> 'IOIter':
         """ Context manager function to open the file (the file will be created if it doesn't exist)
 
@@ -53,6 +66,7 @@ class IOIter:
             if dirname:
                 os.makedirs(dirname, exist_ok=True)
             fd = os.open(self.filename, os.O_CREAT | os.O_RDWR | O_BINARY, mode=0o600)
+            _fadvise(fd, 0, 0, POSIX_FADV_SEQUENTIAL)
             self._fd = os.fdopen(fd, 'r+b')
             self._enter_mtime = self.mtime
         else:
@@ -75,19 +89,45 @@ class IOIter:
         """
         self.fd.seek(0)
         self._sha_fn = sha256()
+
+        # On Windows, even if the file is much smaller, it appears to allocate space for
+        # the full requested_read_size on a read() call, so this min(...) makes sure that
+        # we're not wasting time and memory doing that; we only look up the size once, because
+        # the mtime check below will catch the file changing underneath us
+        requested_read_size = min(self.block_size, self.size)
         while True:
             self._check_mtime()
-            # On Windows, even if the file is much smaller, it appears to allocate space for
-            # the full requested_read_size on a read() call, so this min(...) makes sure that
-            # we're not wasting time and memory doing that
-            requested_read_size = min(self.block_size, self.size)
-
             data = self.fd.read(requested_read_size)
-            logger.debug2(f'read {len(data)} bytes from {self.filename}')  # type: ignore[attr-defined]
+            logger.debug2('read %d bytes from %s', len(data), self.filename)  # type: ignore[attr-defined]
             self._sha_fn.update(data)
             if not data:
                 break
             yield data
+            self._drop_cache(len(data))
+        self.fd.seek(0)
+
+    def buffered_reader(self) -> Generator[memoryview, None, None]:
+        """ Iterator for reading the contents of a file into a single, reusable buffer
+
+        This behaves like reader(), except that each block is a memoryview into the same buffer, so
+        no new bytes object is allocated for each block; the caller must be finished with a block
+        before asking for the next one (i.e., it can't hold on to the data).  Since callers can't
+        hold on to the data anyways, blocks are capped at STREAM_BUFFER_SIZE bytes.
+
+        :returns: data for the file in chunks of (at most) self.block_size bytes
+        """
+        self.fd.seek(0)
+        self._sha_fn = sha256()
+        buf = memoryview(bytearray(min(self.block_size, STREAM_BUFFER_SIZE, self.size)))
+        while True:
+            self._check_mtime()
+            data = buf[:self.fd.readinto(buf)]
+            logger.debug2('read %d bytes from %s', len(data), self.filename)  # type: ignore[attr-defined]
+            self._sha_fn.update(data)
+            if not data:
+                break
+            yield data
+            self._drop_cache(len(data))
         self.fd.seek(0)
 
     def writer(self) -> Generator[None, bytes, None]:
@@ -117,7 +157,7 @@ class IOIter:
                 temp_fd.write(self.fd.read())
                 self._fd = temp_fd
 
-            logger.debug2(f'wrote {bytes_written} bytes to {self.filename}')  # type: ignore[attr-defined]
+            logger.debug2('wrote %d bytes to %s', bytes_written, self.filename)  # type: ignore[attr-defined]
             self.fd.flush()
 
     def sha(self) -> str:
@@ -126,6 +166,20 @@ class IOIter:
             raise BufferError('No SHA has been computed')
         return self._sha_fn.hexdigest()
 
+    def drop_cache(self) -> None:
+        """ Tell the kernel that we're done with all of the data in the file """
+        if isinstance(self.fd, io.BufferedRandom):
+            _fadvise(self.fd.fileno(), 0, 0, POSIX_FADV_DONTNEED)
+
+    def _drop_cache(self, length: int) -> None:
+        """ Tell the kernel that we're done with the data we just read (if drop_cache_after_read
+        is set)
+
+        :param length: how many bytes before the current position we're done with
+        """
+        if self.drop_cache_after_read and isinstance(self.fd, io.BufferedRandom):
+            _fadvise(self.fd.fileno(), self.fd.tell() - length, length, POSIX_FADV_DONTNEED)
+
     def _check_mtime(self) -> None:
         """ Check to see if the file has been modified during writing (this isn't guaranteed to
         be correct, because there are other ways to set the mtime to make it look like the file
@@ -189,22 +243,106 @@ class IOIter:
         return self._fd
 
 
+def _fadvise(fd: int, offset: int, length: int, advice: Optional[int]) -> None:
+    """ Give the kernel a hint about how we're going to access a file; this is only an optimization,
+    so it's fine if the platform doesn't support it or the call fails
+    """
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
 def compute_sha(file1: IOIter) -> str:
     """ Helper function for computing the sha of an IOIter; just reads the data and discards it
 
     :returns: the sha256sum of the file
     """
-    for data in file1.reader():
+    for data in file1.buffered_reader():
         pass
     return file1.sha()
 
 
+def _copy_file_range(out_fd: int, in_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(in_fd, out_fd, count, offset)
+
+
+def _sendfile(out_fd: int, in_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+# copy_file_range lets the filesystem do the copy itself (or even just share the blocks); sendfile
+# still has to copy the data, but it doesn't have to pass through userspace
+_KERNEL_COPY_FNS = [
+    copy_fn for name, copy_fn in (('copy_file_range', _copy_file_range), ('sendfile', _sendfile))
+    if hasattr(os, name)
+]
+
+
+def _kernel_copy(file1: IOIter, file2: IOIter) -> bool:
+    """ Copy the contents of file1 into file2 with os.copy_file_range or os.sendfile, so that the
+    data never has to pass through userspace, and then hash the copy (which should be in the page
+    cache now)
+
+    :returns: True if the data was copied, or False if the caller needs to fall back to a regular copy
+    """
+    if (
+        not _KERNEL_COPY_FNS or file_digest is None
+        or not isinstance(file1.fd, io.BufferedRandom) or not isinstance(file2.fd, io.BufferedRandom)
+    ):
+        return False
+
+    file1._check_mtime()
+    file2.fd.truncate()
+    start, size = file2.fd.tell(), file1.size
+    for copy_fn in _KERNEL_COPY_FNS:
+        copied = 0
+        try:
+            while copied < size:
+                sent = copy_fn(file2.fd.fileno(), file1.fd.fileno(), copied, size - copied)
+                if not sent:
+                    break
+                copied += sent
+        except OSError:
+            # not every platform or filesystem supports every kind of kernel copy; if we haven't
+            # written anything yet we can just try the next one
+            if copied:
+                raise
+            continue
+
+        if copied == size:
+            break
+        elif copied:
+            # the source ran out of data part of the way through, so the copy is truncated
+            raise FileChangedException(
+                f'{file1.filename} changed while reading; only copied {copied} of {size} bytes')
+        # some filesystems just return 0 for copies they don't support, so try the next one
+    else:
+        return False
+    file1._check_mtime()
+    logger.debug2('copied %d bytes from %s to %s', copied, file1.filename, file2.filename)  # type: ignore[attr-defined]
+    if file1.drop_cache_after_read:
+        file1.drop_cache()
+
+    # we can't use file2.buffered_reader() here because we just changed file2's mtime out from
+    # under it; file_digest is the same readinto-and-update loop, just without the mtime checks
+    file2.fd.seek(start)
+    file2._sha_fn = file_digest(file2.fd, 'sha256')
+    file1._sha_fn = file2._sha_fn.copy()
+    return True
+
+
 def io_copy(file1: IOIter, file2: IOIter) -> str:
     """ Helper function to copy data from one IOIter to another
 
     :returns: the sha256sum of the copied data
     """
+    if _kernel_copy(file1, file2):
+        return file2.sha()
+
     writer = file2.writer(); next(writer)
-    for data in file1.reader():
+    for data in file1.buffered_reader():
         writer.send(data)
     return file2.sha()
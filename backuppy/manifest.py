@@ -1,10 +1,16 @@
 import sqlite3
+import threading
 import time
+from functools import wraps
+from typing import Any
 from typing import Callable
+from typing import cast
+from typing import Iterable
 from typing import List
 from typing import Optional
 from typing import Set
 from typing import Tuple
+from typing import TypeVar
 
 import colorlog
 
@@ -26,6 +32,16 @@ MANIFEST_FILE = MANIFEST_PREFIX + '{ts}'
 MANIFEST_KEY_FILE = MANIFEST_KEY_PREFIX + '{ts}'
 _MANIFEST_TABLES = {'manifest', 'base_shas'}
 QueryResponse = Tuple[str, List['ManifestEntry']]
+_F = TypeVar('_F', bound=Callable[..., Any])
+
+
+def _locked(fn: _F) -> _F:
+    """ Decorator to serialize access to the manifest's database cursor across threads """
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return fn(self, *args, **kwargs)
+    return cast(_F, wrapper)
 
 
 class ManifestEntry:
@@ -76,8 +92,16 @@ class Manifest:
     def __init__(self, manifest_filename: str):
         """ Connect to a manifest file and optionally initialize a new database """
         self.filename = manifest_filename
-        self._conn = sqlite3.connect(self.filename)
+        # the connection is shared by all of the backup threads, so every access to it has to
+        # go through self._lock (see _locked)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False)
         self._conn.row_factory = sqlite3.Row
+
+        # We only ever write to scratch copies of the manifest (the real one gets encrypted and saved
+        # to the backup store by lock_manifest), and the scratch directory is wiped out after a
+        # crash anyway; so there's no reason to wait for an fsync every time we commit a file
+        self._conn.execute('pragma synchronous = off')
         self._cursor = self._conn.cursor()
         self.changed = False
 
@@ -95,6 +119,7 @@ class Manifest:
             logger.info('This looks like a new manifest; initializing')
             self._create_manifest_tables()
 
+    @_locked
     def get_entry(
         self,
         abs_file_name: str,
@@ -108,21 +133,24 @@ class Manifest:
             specified time
         """
 
+        # This gets called for every file in the backup, so we let sqlite find the latest row (using
+        # the mfst_idx index) instead of fetching the file's entire history and throwing most of it away
         timestamp = timestamp or int(time.time())
         self._cursor.execute(
             '''
             select * from manifest natural left join base_shas
-            where abs_file_name=? and commit_timestamp<=? order by commit_timestamp
+            where abs_file_name=? and commit_timestamp<=?
+            order by commit_timestamp desc, manifest.rowid desc limit 1
             ''',
             (abs_file_name, timestamp),
         )
-        rows = self._cursor.fetchall()
-        if not rows:
+        latest_row = self._cursor.fetchone()
+        if not latest_row:
             return None
 
-        latest_row = rows[-1]
         return ManifestEntry.from_row(latest_row)
 
+    @_locked
     def get_entries_by_sha(self, sha: str) -> List[ManifestEntry]:
         self._cursor.execute(
             'select * from manifest natural left join base_shas where sha like ?',
@@ -131,6 +159,7 @@ class Manifest:
         rows = self._cursor.fetchall()
         return [ManifestEntry.from_row(row) for row in rows]
 
+    @_locked
     def search(
         self,
         like: str = '',
@@ -138,6 +167,8 @@ class Manifest:
         after_timestamp: Optional[int] = None,
         file_limit: Optional[int] = None,
         history_limit: Optional[int] = None,
+        deleted_only: bool = False,
+        changed_only: bool = False,
     ) -> List[QueryResponse]:
         """
         Search the manifest for files matching a particular pattern; if no values are given, return
@@ -148,6 +179,8 @@ class Manifest:
         :param after_timestamp: only return results after this time
         :param file_limit: return no more than this number of files
         :param history_limit: only return this number of changes for a particular file
+        :param deleted_only: only return files whose most recent change is a deletion
+        :param changed_only: only return files that have changed more than once
         :returns: list of ManifestEntries that match the search
         """
 
@@ -157,14 +190,37 @@ class Manifest:
         like_query = f"%{like or ''}%"
         before_timestamp = before_timestamp or int(time.time())
         after_timestamp = after_timestamp or 0
-        self._cursor.execute(
-            '''
+        search_params = (like_query, after_timestamp, before_timestamp)
+        query = '''
             select * from manifest natural left join base_shas
             where abs_file_name like ? and commit_timestamp between ? and ?
-            order by abs_file_name, commit_timestamp desc
-            ''',
-            (like_query, after_timestamp, before_timestamp)
-        )
+        '''
+        params: Tuple[Any, ...] = search_params
+
+        # filter in the query so that SQLite skips the rows we don't want, instead of building
+        # ManifestEntries for them and throwing them away later
+        if deleted_only:
+            query += '''
+                and abs_file_name in (
+                    select abs_file_name from (
+                        select abs_file_name, sha, max(commit_timestamp) from manifest
+                        where abs_file_name like ? and commit_timestamp between ? and ?
+                        group by abs_file_name
+                    ) where sha is null
+                )
+            '''
+            params += search_params
+        if changed_only:
+            query += '''
+                and abs_file_name in (
+                    select abs_file_name from manifest
+                    where abs_file_name like ? and commit_timestamp between ? and ?
+                    group by abs_file_name having count(*) > 1
+                )
+            '''
+            params += search_params
+
+        self._cursor.execute(query + 'order by abs_file_name, commit_timestamp desc', params)
 
         results: List[QueryResponse] = []
         rows, i, file_count = self._cursor.fetchall(), 0, 0
@@ -184,6 +240,7 @@ class Manifest:
 
         return results
 
+    @_locked
     def insert_or_update(self, entry: ManifestEntry) -> None:
         """ Insert a new entry into the manifest
 
@@ -224,6 +281,7 @@ class Manifest:
             self._cursor.execute('delete from base_shas where sha=?', (entry.sha,))
         self._commit()
 
+    @_locked
     def delete(self, abs_file_name: str) -> None:
         """ Mark that a file has been deleted
 
@@ -232,23 +290,38 @@ class Manifest:
 
         :param abs_file_name: the name of the file
         """
+        self.delete_many([abs_file_name])
 
-        if not self.get_entry(abs_file_name):
-            logger.warn('Trying to delete untracked file; nothing written to datastore')
-            return
+    @_locked
+    def delete_many(self, abs_file_names: Iterable[str]) -> None:
+        """ Mark that a group of files have been deleted; this is the same as calling delete for
+        each file, except that all of the records are written in a single transaction
 
+        :param abs_file_names: the names of the files
+        """
         commit_timestamp = int(time.time())
-        self._cursor.execute(
-            'insert into manifest (abs_file_name, commit_timestamp) values (?, ?)',
-            (abs_file_name, commit_timestamp),
-        )
-        self._commit()
+        deleted_rows = []
+        for abs_file_name in abs_file_names:
+            if not self.get_entry(abs_file_name):
+                logger.warn('Trying to delete untracked file; nothing written to datastore')
+                continue
+            deleted_rows.append((abs_file_name, commit_timestamp))
+
+        if deleted_rows:
+            self._cursor.executemany(
+                'insert into manifest (abs_file_name, commit_timestamp) values (?, ?)',
+                deleted_rows,
+            )
+            self._commit()
 
-    def files(self, timestamp: Optional[int] = None) -> Set[str]:
+    @_locked
+    def files(self, timestamp: Optional[int] = None, exclude: Optional[Set[str]] = None) -> Set[str]:
         """ Return all of the (currently-existing) files in the manifest at or before the
         specified time
 
         :param timestamp: the most recent commit timestamp to consider in the manifest
+        :param exclude: filenames to leave out of the result; they're skipped while reading the
+            query results, so we never hold a copy of the whole manifest in memory
         :returns: all of the absolute filenames contained in the manifest matching the criteria
         """
         timestamp = timestamp or int(time.time())
@@ -260,9 +333,16 @@ class Manifest:
             ''',
             (timestamp,),
         )
-        return set(row['abs_file_name'] for row in self._cursor.fetchall())
+        exclude = exclude or set()
+        return {row['abs_file_name'] for row in self._cursor if row['abs_file_name'] not in exclude}
 
+    @_locked
     def find_duplicate_entries(self) -> List[ManifestEntry]:
+        """ Find entries that should have been unique, but aren't
+
+        :returns: the duplicated entries; all of the entries for the same (file, sha, uid, gid, mode)
+            are next to each other, newest first
+        """
         self._cursor.execute(
             '''
             select * from manifest natural left join base_shas
@@ -271,11 +351,13 @@ class Manifest:
                 where sha is not null
                 group by abs_file_name, sha, uid, gid, mode having count(*) > 1
             )
+            order by abs_file_name, sha, uid, gid, mode, commit_timestamp desc
             '''
         )
         rows = self._cursor.fetchall()
         return [ManifestEntry.from_row(row) for row in rows]
 
+    @_locked
     def find_shas_with_multiple_key_pairs(self) -> List[ManifestEntry]:
         self._cursor.execute(
             '''
@@ -290,6 +372,7 @@ class Manifest:
         rows = self._cursor.fetchall()
         return [ManifestEntry.from_row(row) for row in rows]
 
+    @_locked
     def delete_entry(self, entry: ManifestEntry):
         logger.warning(
             f'DELETING ENTRY ({entry.abs_file_name}, {entry.sha}, {entry.commit_timestamp}) '
@@ -427,9 +510,11 @@ def lock_manifest(
     # First generate a new key and nonce to encrypt the manifest
     key_pair = generate_key_pair(options)
 
-    # Next, use that key and nonce to encrypt and save the manifest
+    # Next, use that key and nonce to encrypt and save the manifest; we hold the manifest lock
+    # so that no other thread can modify the database while we're reading it
     new_manifest_filename = MANIFEST_FILE.format(ts=timestamp)
-    with IOIter(local_manifest_filename) as local_manifest, \
+    with manifest._lock, \
+            IOIter(local_manifest_filename) as local_manifest, \
             IOIter(local_manifest_filename + '.enc') as encrypted_manifest:
         signature = compress_and_encrypt(local_manifest, encrypted_manifest, key_pair, options)
         save(encrypted_manifest, new_manifest_filename)
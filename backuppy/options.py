@@ -1,3 +1,4 @@
+import zlib
 from typing import List
 from typing import Optional
 
@@ -5,6 +6,7 @@ from mypy_extensions import TypedDict
 
 
 class OptionsDict(TypedDict):
+    compression_level: int
     discard_diff_percentage: Optional[float]
     max_manifest_versions: Optional[int]
     skip_diff_patterns: List[str]
@@ -13,6 +15,7 @@ class OptionsDict(TypedDict):
 
 
 DEFAULT_OPTIONS = OptionsDict(
+    compression_level=zlib.Z_DEFAULT_COMPRESSION,
     discard_diff_percentage=0.5,
     max_manifest_versions=10,
     skip_diff_patterns=[],
@@ -6,7 +6,6 @@ from typing import Optional
 import colorlog
 
 from backuppy.args import parse_args
-from backuppy.config import setup_config
 
 logger = colorlog.getLogger(__name__)
 DEBUG2 = logging.DEBUG - 5
@@ -71,6 +70,11 @@ def setup_logging(
 
 def main(arg_list: Optional[List[str]] = None) -> None:
     args = parse_args("BackupPY - an open-source backup tool", arg_list)
+
+    # parse_args exits early for --version and --help, so we don't want to pay for importing the
+    # config-parsing code (staticconf and yaml) until we know we're actually going to run something
+    from backuppy.config import setup_config
+
     setup_logging(args.log_level, args.log_file, args.log_file_level)
     setup_config(args.config)
     args.entrypoint(args)
@@ -1,11 +1,14 @@
+import errno
 import os
 import signal
 import sys
+import threading
 import time
 from abc import ABCMeta
 from abc import abstractmethod
 from contextlib import contextmanager
 from functools import partial
+from shutil import disk_usage
 from shutil import rmtree
 from types import FrameType
 from typing import Iterator
@@ -34,6 +37,7 @@ from backuppy.manifest import ManifestEntry
 from backuppy.manifest import unlock_manifest
 from backuppy.options import DEFAULT_OPTIONS
 from backuppy.options import OptionsDict
+from backuppy.util import get_memory_scratch_dir
 from backuppy.util import get_scratch_dir
 from backuppy.util import path_join
 from backuppy.util import regex_search_list
@@ -42,6 +46,11 @@ from backuppy.util import sha_to_path
 logger = colorlog.getLogger(__name__)
 _UNLOCKED_STORE = None
 _SIGNALS_TO_HANDLE = (signal.SIGINT, signal.SIGTERM)
+MAX_MEMORY_STAGING_SIZE = 4 * 1024 * 1024
+# tmpfs is usually small and shared with the rest of the system (docker defaults to 64MB), so
+# don't stage a file in memory unless this much space would still be free afterwards
+MIN_FREE_MEMORY_STAGING_SPACE = 32 * 1024 * 1024
+SHA_LOCK_STRIPES = 64
 
 
 class BackupStore(metaclass=ABCMeta):
@@ -64,6 +73,11 @@ class BackupStore(metaclass=ABCMeta):
         self.config = staticconf.NamespaceReaders(backup_name)  # type: ignore[attr-defined]
         self._manifest = None
 
+        # If multiple threads are backing up files with the same contents, only one of them
+        # should save the data; the rest will find its entry in the manifest and re-use it.  We use
+        # a fixed set of locks (indexed by sha) so that we don't have to keep one around per file
+        self._sha_locks = [threading.Lock() for _ in range(SHA_LOCK_STRIPES)]
+
     @contextmanager
     def unlock(self, *, dry_run=False, preserve_scratch=False) -> Iterator:
         """
@@ -81,6 +95,7 @@ class BackupStore(metaclass=ABCMeta):
         # we have to create the scratch dir regardless of whether --dry-run is enabled
         # because we still need to be able to figure out what's changed and what we should do
         rmtree(get_scratch_dir(), ignore_errors=True)
+        rmtree(get_memory_scratch_dir(), ignore_errors=True)
         os.makedirs(get_scratch_dir(), exist_ok=True)
 
         try:
@@ -135,50 +150,56 @@ class BackupStore(metaclass=ABCMeta):
         with IOIter(abs_file_name) as new_file:
             new_sha = compute_sha(new_file)
 
-            # If the file hasn't been backed up before, or if it's been deleted previously, save a
-            # new copy; we make a copy here to ensure that the contents don't change while backing
-            # the file up, and that we have the correct sha
-            if force_copy or not curr_entry or not curr_entry.sha:
-                new_entry = self._write_copy(abs_file_name, new_sha, new_file, force_copy, dry_run)
-
-            # If the file has been backed up, check to see if it's changed by comparing shas
-            elif new_sha != curr_entry.sha:
-                if regex_search_list(abs_file_name, self.options['skip_diff_patterns']):
-                    new_entry = self._write_copy(abs_file_name, new_sha, new_file, False, dry_run)
-                else:
-                    new_entry = self._write_diff(
+            # Hold the lock for this sha until the manifest has been updated, so that two files
+            # with the same contents don't both try to save the data
+            with self._lock_sha(new_sha):
+                # If the file hasn't been backed up before, or if it's been deleted previously, save a
+                # new copy; we make a copy here to ensure that the contents don't change while backing
+                # the file up, and that we have the correct sha
+                if force_copy or not curr_entry or not curr_entry.sha:
+                    new_entry = self._write_copy(abs_file_name, new_sha, new_file, force_copy, dry_run)
+
+                # If the file has been backed up, check to see if it's changed by comparing shas
+                elif new_sha != curr_entry.sha:
+                    if regex_search_list(abs_file_name, self.options['skip_diff_patterns']):
+                        new_entry = self._write_copy(abs_file_name, new_sha, new_file, False, dry_run)
+                    else:
+                        new_entry = self._write_diff(
+                            abs_file_name,
+                            new_sha,
+                            curr_entry,
+                            new_file,
+                            dry_run,
+                        )
+
+                # If the sha is the same but metadata on the file has changed, we just store the updated
+                # metadata
+                elif (
+                    new_file.uid != curr_entry.uid or
+                    new_file.gid != curr_entry.gid or
+                    new_file.mode != curr_entry.mode
+                ):
+                    logger.info(f'Saving changed metadata for {abs_file_name}')
+                    new_entry = ManifestEntry(
                         abs_file_name,
-                        new_sha,
-                        curr_entry,
-                        new_file,
-                        dry_run,
+                        curr_entry.sha,
+                        curr_entry.base_sha,
+                        new_file.uid,
+                        new_file.gid,
+                        new_file.mode,
+                        curr_entry.key_pair,  # NOTE: this is safe because the data has not changed!
+                        curr_entry.base_key_pair,
                     )
+                else:
+                    # we don't want to flood the log with all the files that haven't changed
+                    logger.debug(f'{abs_file_name} is up to date!')
 
-            # If the sha is the same but metadata on the file has changed, we just store the updated
-            # metadata
-            elif (
-                new_file.uid != curr_entry.uid or
-                new_file.gid != curr_entry.gid or
-                new_file.mode != curr_entry.mode
-            ):
-                logger.info(f'Saving changed metadata for {abs_file_name}')
-                new_entry = ManifestEntry(
-                    abs_file_name,
-                    curr_entry.sha,
-                    curr_entry.base_sha,
-                    new_file.uid,
-                    new_file.gid,
-                    new_file.mode,
-                    curr_entry.key_pair,  # NOTE: this is safe because the data has not changed!
-                    curr_entry.base_key_pair,
-                )
-            else:
-                # we don't want to flood the log with all the files that haven't changed
-                logger.debug(f'{abs_file_name} is up to date!')
+                if new_entry and not dry_run:
+                    self.manifest.insert_or_update(new_entry)
+                return new_entry  # test_m2_crash_after_file_save
 
-            if new_entry and not dry_run:
-                self.manifest.insert_or_update(new_entry)
-            return new_entry  # test_m2_crash_after_file_save
+    def _lock_sha(self, sha: str) -> threading.Lock:
+        return self._sha_locks[hash(sha) % SHA_LOCK_STRIPES]
 
     def restore_entry(
         self,
@@ -206,12 +227,26 @@ class BackupStore(metaclass=ABCMeta):
 
         # We compress and encrypt the file on the local file system, and then pass the encrypted
         # file to the backup store to handle atomically
-        filename = path_join(get_scratch_dir(), dest)
+        filename = self._staging_filename(dest, src.size)
+        try:
+            signature = self._stage_and_save(src, filename, dest, key_pair)
+        except OSError as e:
+            # Other processes (or other backup threads) can fill up the in-memory scratch space
+            # after we've picked it, so if we run out of room there, try again on disk instead of
+            # skipping the file
+            if e.errno != errno.ENOSPC or not _is_memory_staged(filename):
+                raise
+            logger.warning(f'Ran out of memory-backed scratch space staging {dest}; retrying on disk')
+            _remove_staged_file(filename)
+            filename = path_join(get_scratch_dir(), dest)
+            signature = self._stage_and_save(src, filename, dest, key_pair)
+        _remove_staged_file(filename)  # the store may have moved the file into place instead
+        return signature
 
+    def _stage_and_save(self, src: IOIter, filename: str, dest: str, key_pair: bytes) -> bytes:
         with IOIter(filename) as encrypted_save_file:
             signature = compress_and_encrypt(src, encrypted_save_file, key_pair, self.options)
             self._save(encrypted_save_file, dest)  # test_f1_crash_file_save
-        os.remove(filename)
         return signature
 
     def load(
@@ -267,6 +302,7 @@ class BackupStore(metaclass=ABCMeta):
 
         if not preserve_scratch:
             rmtree(get_scratch_dir(), ignore_errors=True)
+            rmtree(get_memory_scratch_dir(), ignore_errors=True)
         self._manifest = None  # test_m1_crash_after_save
 
     def _write_copy(
@@ -298,6 +334,8 @@ class BackupStore(metaclass=ABCMeta):
             base_key_pair,
         )
         if not dry_run and not entry_data:
+            # this is the last time we read the file, so we don't need to keep it in the page cache
+            file_obj.drop_cache_after_read = True
             signature = self.save(file_obj, new_entry.sha, key_pair)  # append the HMAC before writing to db
             new_entry.key_pair = key_pair + signature
         return new_entry
@@ -355,6 +393,8 @@ class BackupStore(metaclass=ABCMeta):
                     file_obj.fd.seek(0)
                     return self._write_copy(abs_file_name, new_sha, file_obj, False, dry_run)
 
+                # we've read the file for the last time, so we don't need to keep it in the page cache
+                file_obj.drop_cache()
                 new_entry.sha = new_sha
                 if not dry_run:
                     signature = self.save(fd_diff, new_entry.sha, key_pair)
@@ -373,6 +413,27 @@ class BackupStore(metaclass=ABCMeta):
         else:
             return None
 
+    def _staging_filename(self, dest: str, size: int) -> str:
+        """ Where to write the compressed and encrypted data before handing it off to _save;
+        stores can override this to stage the data somewhere that's cheaper for _save to use
+
+        By default, small files are staged in memory (if possible, and if there's plenty of room) so
+        that they don't make a round trip through the disk before they get uploaded; larger files go to
+        the scratch directory.
+
+        :param dest: the name of the file in the store
+        :param size: the (uncompressed) size of the data to stage
+        :returns: the local filename to write the data to
+        """
+        memory_scratch_dir = get_memory_scratch_dir()
+        if (
+            size <= MAX_MEMORY_STAGING_SIZE
+            and memory_scratch_dir != get_scratch_dir()
+            and _free_space(os.path.dirname(memory_scratch_dir)) >= size + MIN_FREE_MEMORY_STAGING_SPACE
+        ):
+            return path_join(memory_scratch_dir, dest)
+        return path_join(get_scratch_dir(), dest)
+
     @abstractmethod
     def _save(self, src: IOIter, dest: str) -> None:  # pragma: no cover
         pass
@@ -446,3 +507,22 @@ def _unregister_store() -> None:
 
     for sig in _SIGNALS_TO_HANDLE:
         signal.signal(sig, signal.SIG_DFL)
+
+
+def _free_space(path: str) -> int:
+    try:
+        return disk_usage(path).free
+    except OSError:
+        return 0
+
+
+def _is_memory_staged(filename: str) -> bool:
+    memory_scratch_dir = get_memory_scratch_dir()
+    return memory_scratch_dir != get_scratch_dir() and filename.startswith(memory_scratch_dir + os.sep)
+
+
+def _remove_staged_file(filename: str) -> None:
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
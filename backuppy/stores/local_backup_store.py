@@ -11,6 +11,7 @@ from backuppy.util import path_join
 
 
 logger = colorlog.getLogger(__name__)
+_STAGING_DIR = '.staging'
 
 
 class LocalBackupStore(BackupStore):
@@ -22,6 +23,19 @@ class LocalBackupStore(BackupStore):
             self.config.read_string('protocol.location'),
             backup_name,
         ))
+        self.staging_location = path_join(self.backup_location, _STAGING_DIR)
+
+    def do_cleanup(self, dry_run: bool, preserve_scratch: bool) -> None:
+        super().do_cleanup(dry_run, preserve_scratch)
+        if not preserve_scratch:
+            shutil.rmtree(self.staging_location, ignore_errors=True)
+
+    def _staging_filename(self, dest: str, size: int = 0) -> str:
+        # If the data is staged on the same filesystem as the backup, we can just rename it into
+        # place instead of copying it; windows does not allow moving an open FD, though
+        if os.name == 'nt':
+            return super()._staging_filename(dest, size)
+        return path_join(self.staging_location, dest)
 
     def _save(self, src: IOIter, dest: str) -> None:
         assert src.filename  # can't have a tmpfile here
@@ -34,8 +48,11 @@ class LocalBackupStore(BackupStore):
 
         logger.info(f'Writing {src.filename} to {abs_backup_path}')  # test_f2_lbs_atomicity_1
 
-        # windows does not allow deleting an open FD, so we copy here and delete the original later
-        shutil.copy2(src.filename, abs_backup_path)
+        if src.filename == self._staging_filename(dest):
+            os.replace(src.filename, abs_backup_path)
+        else:
+            # windows does not allow deleting an open FD, so we copy here and delete the original later
+            shutil.copy2(src.filename, abs_backup_path)
         return  # test_f2_lbs_atomicity_2
 
     def _load(self, path: str, output_file: IOIter) -> IOIter:
@@ -53,6 +70,10 @@ class LocalBackupStore(BackupStore):
         results: List[str] = []
 
         for root, dirs, files in os.walk(self.backup_location):
+            # data that's still being saved isn't part of the backup yet
+            if root == self.backup_location and _STAGING_DIR in dirs:
+                dirs.remove(_STAGING_DIR)
+
             # look through all of the directories and see if any of them match the prefix;
             # if they don't match here, there's no reason to recurse into them, so just pop
             # them off (we have to modify dirs in-place here).  We start at the end for "efficiency"
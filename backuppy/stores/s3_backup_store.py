@@ -81,12 +81,15 @@ class S3BackupStore(BackupStore):
             return 'STANDARD'
 
         storage_class = self.config.read_string('protocol.storage_class', default='STANDARD')
+        if storage_class in REGULAR_STORAGE_CLASSES:
+            return storage_class
+
+        size = obj.size
         if (
-            storage_class in REGULAR_STORAGE_CLASSES
-            or (storage_class == 'STANDARD_IA' and obj.size >= STANDARD_IA_SIZE)
-            or (storage_class == 'ONEZONE_IA' and obj.size >= ONEZONE_IA_SIZE)
-            or (storage_class == 'GLACIER' and obj.size >= GLACIER_SIZE)
-            or (storage_class == 'DEEP_ARCHIVE' and obj.size >= DEEP_ARCHIVE_SIZE)
+            (storage_class == 'STANDARD_IA' and size >= STANDARD_IA_SIZE)
+            or (storage_class == 'ONEZONE_IA' and size >= ONEZONE_IA_SIZE)
+            or (storage_class == 'GLACIER' and size >= GLACIER_SIZE)
+            or (storage_class == 'DEEP_ARCHIVE' and size >= DEEP_ARCHIVE_SIZE)
         ):
             return storage_class
         else:
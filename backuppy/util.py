@@ -1,3 +1,4 @@
+import logging
 import os
 import re
 import sys
@@ -18,6 +19,9 @@ from iteration_utilities import deepflatten
 from backuppy.exceptions import InputParseError
 
 logger = colorlog.getLogger(__name__)
+SHM_DIR = '/dev/shm'
+# backreferences and global inline flags change meaning when patterns are joined together
+_UNCOMBINABLE_EXCLUSION_RE = re.compile(r'\\[1-9]|\(\?P=|^\(\?[aiLmsux]+\)')
 
 
 def ask_for_confirmation(prompt: str, default: str = 'y'):
@@ -46,6 +50,36 @@ def compile_exclusions(exclusions: List[str]) -> List[Pattern]:
     return [re.compile(excl) for excl in deepflatten(exclusions, ignore=str)]
 
 
+def _combine_exclusions(exclusions: List[Pattern]) -> Optional[Pattern]:
+    """ Join all of the exclusions into a single alternation, so that each path only needs to be
+    searched once instead of once per pattern
+
+    :param exclusions: the list of compiled exclusion regexes
+    :returns: the combined regex, or None if there are no exclusions or they can't be safely
+        combined (because of inline flags, duplicate group names, or backreferences)
+    """
+    if not exclusions or any(_UNCOMBINABLE_EXCLUSION_RE.search(excl.pattern) for excl in exclusions):
+        return None
+    try:
+        return re.compile('|'.join(f'(?:{excl.pattern})' for excl in exclusions))
+    except re.error:
+        return None
+
+
+def _is_excluded(name: str, exclusions: List[Pattern], combined: Optional[Pattern]) -> bool:
+    if combined:
+        if not combined.search(name):
+            return False
+    elif not any(excl.search(name) for excl in exclusions):
+        return False
+
+    # we only need to figure out which patterns matched if we're actually going to log it
+    if logger.isEnabledFor(logging.INFO):
+        matched_patterns = [excl.pattern for excl in exclusions if excl.search(name)]
+        logger.info(f'{name} matched exclusion(s) "{matched_patterns}"; skipping')
+    return True
+
+
 def file_walker(
     path,
     on_error: Optional[Callable] = None,
@@ -56,7 +90,7 @@ def file_walker(
     is randomized so we don't always back up the same files in the same order.
 
     :param path: root path to start walking
-    :param on_error: function to call if something goes wrong in os.walk
+    :param on_error: function to call if something goes wrong while scanning a directory
     :param exclusions: list of regexes to skip; if you want the regex to _only_
         match directories, you must end the pattern with os.sep.  If you want it
         to _only_ match files, it must end with $.  Otherwise, the pattern will
@@ -65,32 +99,45 @@ def file_walker(
         that don't match anything in exclusions
     """
     exclusions = exclusions or []
-    for root, dirs, files in os.walk(path, onerror=on_error):
-
-        # Skip files and directories that match any of the specified regular expressions
-        new_dirs = []
-        for d in dirs:
-            abs_dir_name = path_join(root, d) + os.sep
-            matched_patterns = [excl.pattern for excl in exclusions if excl.search(abs_dir_name)]
-            if matched_patterns:
-                logger.info(f'{abs_dir_name} matched exclusion(s) "{matched_patterns}"; skipping')
-            else:
-                new_dirs.append(d)  # don't need the abs name here
-
-        # os.walk allows you to modify the dirs in-place to control the order in which
-        # things are visited; we do that here to ensure that we're not always starting
+    combined_exclusions = _combine_exclusions(exclusions)
+
+    # We use os.scandir directly instead of os.walk so that we can re-use the DirEntry paths and
+    # cached file types; like os.walk, we don't follow symlinks to directories
+    dir_stack = [os.path.normpath(path)]
+    while dir_stack:
+        root = dir_stack.pop()
+        dirs: List[str] = []
+        files: List[str] = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if not is_dir:
+                        files.append(entry.path)
+                    # Skip directories that match any of the specified regular expressions
+                    elif (
+                        not _is_excluded(entry.path + os.sep, exclusions, combined_exclusions)
+                        and not entry.is_symlink()
+                    ):
+                        dirs.append(entry.path)
+        except OSError as e:
+            if on_error:
+                on_error(e)
+            continue
+
+        # We shuffle the order in which things are visited to ensure that we're not always starting
         # our backup in the same place and going through in the same order, which could
         # result in the later things never getting backed up if there is some systemic crash
-        shuffle(new_dirs)
-        dirs[:] = new_dirs
+        shuffle(dirs)
+        dir_stack.extend(reversed(dirs))  # reversed so that we visit them in the shuffled order
         shuffle(files)
-        for f in files:
-            abs_file_name = path_join(root, f)
-            matched_patterns = [excl.pattern for excl in exclusions if excl.search(abs_file_name)]
-            if matched_patterns:
-                logger.info(f'{abs_file_name} matched exclusion(s) "{matched_patterns}"; skipping')
-            else:
-                yield path_join(root, f)
+        for abs_file_name in files:
+            if not _is_excluded(abs_file_name, exclusions, combined_exclusions):
+                yield abs_file_name
 
 
 def format_sha(sha: str, sha_length: int) -> Optional[str]:
@@ -105,6 +152,13 @@ def get_scratch_dir() -> str:
     return os.path.join(gettempdir(), 'backuppy')
 
 
+def get_memory_scratch_dir() -> str:
+    """ Scratch space that lives in RAM (tmpfs) instead of on disk, if the system provides it """
+    if os.path.isdir(SHM_DIR):
+        return os.path.join(SHM_DIR, 'backuppy')
+    return get_scratch_dir()
+
+
 def regex_search_list(needle: str, haystack: List[str]):
     for pattern in haystack:
         if re.search(pattern, needle):
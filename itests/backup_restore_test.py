@@ -33,6 +33,7 @@ RESTORE_ARGS = argparse.Namespace(
     sha=None,
     like='',
     preserve_scratch_dir=True,
+    jobs=2,
     yes=False,
 )
 
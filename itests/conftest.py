@@ -27,6 +27,7 @@ BACKUP_ARGS = argparse.Namespace(
     log_level='debug',
     config=ITEST_CONFIG,
     preserve_scratch_dir=True,
+    jobs=1,
     name='data1_backup',
 )
 
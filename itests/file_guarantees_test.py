@@ -23,6 +23,7 @@ BACKUP_ARGS = argparse.Namespace(
     config=ITEST_CONFIG,
     preserve_scratch_dir=False,
     dry_run=False,
+    jobs=1,
     name='data1_backup',
 )
 
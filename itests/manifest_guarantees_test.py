@@ -24,6 +24,7 @@ BACKUP_ARGS = argparse.Namespace(
     config=ITEST_CONFIG,
     preserve_scratch_dir=True,
     dry_run=False,
+    jobs=1,
     name='data1_backup',
 )
 
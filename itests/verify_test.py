@@ -24,6 +24,7 @@ VERIFY_ARGS = argparse.Namespace(
     like='',
     show_all=True,
     yes=True,
+    jobs=2,
 )
 
 
@@ -0,0 +1,31 @@
+import argparse
+
+import pytest
+
+from backuppy.args import _sniff_subcommand
+from backuppy.args import positive_int
+
+
+@pytest.mark.parametrize('arg_list,expected', [
+    ([], None),
+    (['--help'], None),
+    (['backup', '--name', 'list'], 'backup'),
+    (['--log-level', 'debug', 'restore', '--name', 'foo'], 'restore'),
+    (['--config', 'list', 'verify'], 'verify'),
+    (['--conf', 'list', 'verify'], 'verify'),
+    (['--config=list', 'get'], 'get'),
+    (['--config', 'put'], None),
+])
+def test_sniff_subcommand(arg_list, expected):
+    assert _sniff_subcommand(arg_list) == expected
+
+
+@pytest.mark.parametrize('value,expected', [('1', 1), ('8', 8)])
+def test_positive_int(value, expected):
+    assert positive_int(value) == expected
+
+
+@pytest.mark.parametrize('value', ['0', '-2', 'foo'])
+def test_positive_int_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        positive_int(value)
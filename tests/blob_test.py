@@ -1,7 +1,12 @@
 from hashlib import sha256
+from itertools import zip_longest
 
+import bsdiff4
+import mock
 import pytest
 
+from backuppy.blob import _common_prefix_len
+from backuppy.blob import _common_suffix_len
 from backuppy.blob import apply_diff
 from backuppy.blob import compute_diff
 from backuppy.exceptions import DiffParseError
@@ -36,9 +41,56 @@ def test_round_trip(mock_open_streams, sha_fn):
     assert new._fd.read() == new_contents
 
 
+def test_round_trip_unchanged_blocks(mock_open_streams):
+    new_contents = b'asdfasdfzzz'
+    orig, new, diff = mock_open_streams
+    new._fd.write(new_contents)
+    with mock.patch('backuppy.blob.bsdiff4.diff', wraps=bsdiff4.diff) as mock_diff:
+        compute_diff(orig, new, diff)
+    assert mock_diff.call_args_list == [mock.call(b'a', b'zz'), mock.call(b'', b'z')]
+
+    new._fd.seek(0)
+    new._fd.write(b'')
+    apply_diff(orig, diff, new)
+    new._fd.seek(0)
+    assert new._fd.read() == new_contents
+
+
+def test_apply_legacy_diff(mock_open_streams):
+    new_contents = b'asdfrfsdcac'
+    orig, new, diff = mock_open_streams
+    orig_contents = orig._fd.getvalue()
+    for orig_block, new_block in zip_longest(
+        [orig_contents[i:i + 2] for i in range(0, len(orig_contents), 2)],
+        [new_contents[i:i + 2] for i in range(0, len(new_contents), 2)],
+        fillvalue=b'',
+    ):
+        block_diff = bsdiff4.diff(orig_block, new_block)
+        diff._fd.write(str(len(block_diff)).encode() + b'|' + block_diff)
+
+    apply_diff(orig, diff, new)
+    new._fd.seek(0)
+    assert new._fd.read() == new_contents
+
+
 def test_compute_diff_with_large_diff(mock_open_streams):
     orig, new, diff = mock_open_streams
     new._fd.write(b'asdfasdfasdfa')
     new._fd.seek(0)
     with pytest.raises(DiffTooLargeException):
         compute_diff(orig, new, diff, 0.5)
+
+
+@pytest.mark.parametrize('orig,new,prefix_len,suffix_len', [
+    (b'', b'', 0, 0),
+    (b'asdf', b'asdf', 4, 0),
+    (b'asdf', b'asdfasdf', 4, 0),
+    (b'asdfasdf', b'asdf', 4, 0),
+    (b'asdf', b'qwer', 0, 0),
+    (b'asdf', b'aszf', 2, 1),
+    (b'a' * 200000 + b'b' + b'c' * 100000, b'a' * 200000 + b'd' + b'c' * 100000, 200000, 100000),
+    (b'a' * 200000 + b'c' * 100000, b'a' * 123456 + b'c' * 100000, 123456, 100000),
+])
+def test_common_prefix_and_suffix(orig, new, prefix_len, suffix_len):
+    assert _common_prefix_len(orig, new) == prefix_len
+    assert _common_suffix_len(orig, new, prefix_len) == suffix_len
@@ -30,18 +30,43 @@ def test_scan_directory(file_walker, dry_run):
     ]
 
 
+@mock.patch('backuppy.cli.backup.file_walker')
+@pytest.mark.parametrize('queued_per_job', [1, 4])
+@pytest.mark.parametrize('dry_run', [True, False])
+def test_scan_directory_parallel(file_walker, dry_run, queued_per_job):
+    file_walker.return_value = ['/file1', '/error', '/file2', '/file3']
+    store = mock.MagicMock(spec=BackupStore)
+
+    def save_if_new(filename, dry_run=dry_run):
+        if filename == '/error':
+            raise Exception('oops!')
+
+    store.save_if_new.side_effect = save_if_new
+
+    with mock.patch('backuppy.cli.backup.QUEUED_FILES_PER_JOB', queued_per_job):
+        marked_files = _scan_directory('/', store, None, dry_run, jobs=2)
+    assert marked_files == {'/file1', '/error', '/file2', '/file3'}
+    assert sorted(store.save_if_new.call_args_list) == [
+        mock.call('/error', dry_run=dry_run),
+        mock.call('/file1', dry_run=dry_run),
+        mock.call('/file2', dry_run=dry_run),
+        mock.call('/file3', dry_run=dry_run),
+    ]
+
+
 @pytest.mark.parametrize('dry_run', [True, False])
 def test_main(dry_run):
     with mock.patch('backuppy.cli.backup.staticconf.YamlConfiguration'), \
             mock.patch('backuppy.cli.backup._scan_directory') as mock_scan, \
             mock.patch('backuppy.cli.backup.get_backup_store') as mock_get_store:
         store = mock_get_store.return_value
-        store.manifest.files.return_value = {'/file1', '/file2', '/file3', '/file4'}
+        store.manifest.files.side_effect = lambda exclude: {'/file1', '/file2', '/file3', '/file4'} - exclude
         mock_scan.side_effect = [{'/file1', '/file2', '/file3'}, {'/file1'}, {'/file2', '/file3'}]
         args = argparse.Namespace(
             config='backuppy.conf',
             preserve_scratch_dir=False,
             dry_run=dry_run,
+            jobs=1,
             name='fake_backup1',
         )
         main(args)
@@ -57,6 +82,6 @@ def test_main(dry_run):
         assert mock_scan.call_args_list[2][0][2] == [
             re.compile('dont_back_this_up'), re.compile('bar')]
         if not dry_run:
-            assert all([c == mock.call('/file4') for c in store.manifest.delete.call_args_list])
+            assert store.manifest.delete_many.call_args_list == [mock.call({'/file4'})] * 2
         else:
-            assert store.manifest.delete.call_count == 0
+            assert store.manifest.delete_many.call_count == 0
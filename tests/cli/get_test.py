@@ -66,9 +66,10 @@ def test_main_no_entries(args):
         main(args)
 
 
-def test_main_get_manifest(args):
+@pytest.mark.parametrize('index,expected', [(0, '999'), (2, '456'), (-1, '123'), (-2, '456')])
+def test_main_get_manifest(args, index, expected):
     args.sha = None
-    args.manifest = 2
+    args.manifest = index
     backup_store = mock.MagicMock(_query=mock.Mock(return_value=[
         '/' + MANIFEST_PREFIX + '123',
         '/' + MANIFEST_PREFIX + '456',
@@ -79,4 +80,4 @@ def test_main_get_manifest(args):
             mock.patch('backuppy.cli.get.get_manifest_keypair'), \
             mock.patch('backuppy.cli.get._get') as mock_get:
         main(args)
-        assert mock_get.call_args[0][0] == MANIFEST_PREFIX + '456'
+        assert mock_get.call_args[0][0] == MANIFEST_PREFIX + expected
@@ -4,6 +4,7 @@ import re
 import mock
 import pytest
 
+from backuppy.cli.list import _get_abs_roots
 from backuppy.cli.list import _print_details
 from backuppy.cli.list import _print_summary
 from backuppy.cli.list import _split_root_prefix
@@ -35,38 +36,26 @@ def mock_search_results():
 
 
 def test_split_root_prefix():
-    assert _split_root_prefix('/path/1/the_file', 'fake_backup2') == ('/path/1/', 'the_file')
+    assert _split_root_prefix('/path/1/the_file', _get_abs_roots('fake_backup2')) == ('/path/1/', 'the_file')
 
 
 def test_split_root_prefix_not_present():
     with pytest.raises(ValueError):
-        _split_root_prefix('/path/0/the_file', 'fake_backup2')
+        _split_root_prefix('/path/0/the_file', _get_abs_roots('fake_backup2'))
 
 
-@pytest.mark.parametrize('deleted,changed', [
-    (False, False),
-    (True, False),
-    (False, True),
-    (True, True),
-])
-def test_print_summary(deleted, changed, mock_search_results, capsys):
-    _print_summary('fake_backup2', mock_search_results, deleted, changed)
+def test_print_summary(mock_search_results, capsys):
+    _print_summary('fake_backup2', mock_search_results)
     out, err = capsys.readouterr()
-    if not deleted:
-        assert re.search(r'file1\s+3\s+' + format_time(100), out)
-        assert re.search(r'file2\s+2\s+' + format_time(105), out)
-        if not changed:
-            assert re.search(r'file4\s+1\s+' + format_time(105), out)
-    elif changed:
-        assert not re.search('file[12]', out)
-    else:
-        assert not re.search('file[124]', out)
-
+    assert re.search(r'file1\s+3\s+' + format_time(100), out)
+    assert re.search(r'file2\s+2\s+' + format_time(105), out)
+    assert re.search(r'file4\s+1\s+' + format_time(105), out)
     assert re.search(r'file3\s+2\s+y\s+' + format_time(176), out)
+    assert re.findall(r'^/path/\d/$', out, re.MULTILINE) == ['/path/1/', '/path/2/']
 
 
 def test_print_details(mock_search_results, capsys):
-    _print_details('fake_backup2', mock_search_results, False, False, 5)
+    _print_details('fake_backup2', mock_search_results, 5)
     out, err = capsys.readouterr()
     assert re.search(r'ab1de\.\.\..*' + format_time(100), out)
     assert re.search(r'ab2de\.\.\..*' + format_time(75), out)
@@ -107,6 +96,8 @@ def test_main(after, before, details):
             file_limit=None,
             history_limit=None,
             like=None,
+            deleted_only=False,
+            changed_only=False,
         )
         assert mock_summary.call_count == int(not details)
         assert mock_details.call_count == int(details)
@@ -6,6 +6,7 @@ import pytest
 
 from backuppy.cli.restore import _confirm_restore
 from backuppy.cli.restore import _parse_destination
+from backuppy.cli.restore import _restore
 from backuppy.cli.restore import main
 from backuppy.manifest import ManifestEntry
 
@@ -50,6 +51,23 @@ def test_confirm_restore(retval, mock_manifest_entry_list, capsys):
     assert ('WARNING' in out) == retval
 
 
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_restore(fs, jobs):
+    entries = [
+        ManifestEntry(f'/path/0/foo/{i}', f'abcd123{i}', None, 1000, 1000, 35677, b'1111', None)
+        for i in range(4)
+    ]
+    backup_store = mock.Mock()
+    _restore(entries, '/restore/path', backup_store, jobs)
+
+    assert sorted(call[0][0].abs_file_name for call in backup_store.restore_entry.call_args_list) == [
+        e.abs_file_name for e in entries
+    ]
+    assert sorted(call[0][3].filename for call in backup_store.restore_entry.call_args_list) == [
+        f'/restore/path/path/0/foo/{i}' for i in range(4)
+    ]
+
+
 @pytest.mark.parametrize('sha,entries', [
     (None, None),
     ('abcd1234', []),
@@ -80,6 +98,7 @@ def test_main(retval, sha, entries):
             name='fake_backup1',
             sha=sha,
             preserve_scratch_dir=False,
+            jobs=1,
             yes=False,
         ))
         assert mock_restore.call_count == int(retval)
@@ -88,4 +107,5 @@ def test_main(retval, sha, entries):
                 entries,
                 '/restore/path/fake_backup1',
                 backup_store,
+                1,
             )]
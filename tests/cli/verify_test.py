@@ -1,13 +1,18 @@
 import argparse
 from contextlib import ExitStack
+from copy import copy
+from hashlib import sha256
 
 import mock
 import pytest
 
+from backuppy.cli.verify import _check_entry
 from backuppy.cli.verify import _fix_duplicate_entries
 from backuppy.cli.verify import _fix_shas_with_multiple_key_pairs
 from backuppy.cli.verify import _verify
 from backuppy.cli.verify import main
+from backuppy.cli.verify import QUEUED_ENTRIES_PER_JOB
+from backuppy.exceptions import MismatchedSHAError
 from backuppy.manifest import ManifestEntry
 
 
@@ -25,6 +30,21 @@ def mock_manifest_entry_list():
     )]
 
 
+@pytest.mark.parametrize('sha', [sha256(b'restored data').hexdigest(), 'abcd1234'])
+def test_check_entry(mock_manifest_entry_list, sha):
+    entry = mock_manifest_entry_list[0]
+    entry.sha = sha
+    backup_store = mock.Mock()
+
+    def restore_entry(entry, orig_file, diff_file, restore_file):
+        writer = restore_file.writer(); next(writer)
+        writer.send(b'restored data')
+
+    backup_store.restore_entry.side_effect = restore_entry
+    with (pytest.raises(MismatchedSHAError) if sha == 'abcd1234' else ExitStack()):
+        _check_entry(entry, backup_store)
+
+
 def test_fix_duplicate_entries_ok(capsys):
     backup_store = mock.MagicMock()
     _fix_duplicate_entries(backup_store)
@@ -76,20 +96,55 @@ def test_fix_shas_with_multiple_key_pairs(has_good_entry, mock_manifest_entry_li
     assert backup_store.save_if_new.call_count == (0 if has_good_entry else 1)
 
 
-def test_verify_ok(mock_manifest_entry_list, capsys):
-    with mock.patch('backuppy.cli.verify.compute_sha', return_value='abcd1234'):
-        _verify(mock_manifest_entry_list, mock.Mock(), True)
+@pytest.mark.parametrize('jobs', [0, 1, 2])
+def test_verify_ok(mock_manifest_entry_list, capsys, jobs):
+    with mock.patch('backuppy.cli.verify.IOIter.sha', return_value='abcd1234'):
+        _verify(mock_manifest_entry_list, mock.Mock(), True, jobs)
     out, _ = capsys.readouterr()
     assert 'Checking /path/0/foo/bar... OK!' in out
 
 
-def test_verify_bad_sha(mock_manifest_entry_list):
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_verify_bad_sha(mock_manifest_entry_list, jobs):
     backup_store = mock.Mock()
     with mock.patch('backuppy.cli.verify.ask_for_confirmation', return_value=True):
-        _verify(mock_manifest_entry_list, backup_store, True)
+        _verify(mock_manifest_entry_list, backup_store, True, jobs)
     assert backup_store.save_if_new.call_args == mock.call('/path/0/foo/bar', force_copy=True)
 
 
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_verify_rechecks_fixed_shas(mock_manifest_entry_list, jobs, capsys):
+    entries = [mock_manifest_entry_list[0], copy(mock_manifest_entry_list[0])]
+    backup_store = mock.Mock()
+    backup_store.save_if_new.return_value = ManifestEntry(
+        '/path/0/foo/bar', 'abcd1234', None, 1000, 1000, 35677, b'2222', None,
+    )
+
+    def check_entry(entry, backup_store):
+        if entry.key_pair != b'2222':
+            raise Exception('bad key')
+
+    with mock.patch('backuppy.cli.verify.ask_for_confirmation', return_value=True), \
+            mock.patch('backuppy.cli.verify._check_entry', side_effect=check_entry):
+        _verify(entries, backup_store, True, jobs)
+    out, _ = capsys.readouterr()
+    assert backup_store.save_if_new.call_count == 1
+    assert out.count('ERROR: bad key') == 1
+    assert out.count('OK!') == 1
+    assert entries[1].key_pair == b'2222'
+
+
+def test_verify_bounded_queue(mock_manifest_entry_list):
+    entries = [copy(mock_manifest_entry_list[0]) for _ in range(20)]
+    checks_at_prompt = []
+    with mock.patch('backuppy.cli.verify._check_entry', side_effect=Exception('bad key')) as mock_check, \
+            mock.patch('backuppy.cli.verify.ask_for_confirmation', return_value=False) as mock_confirm:
+        mock_confirm.side_effect = lambda _: checks_at_prompt.append(mock_check.call_count)
+        _verify(entries, mock.Mock(), True, 2)
+    assert len(checks_at_prompt) == 20
+    assert checks_at_prompt[0] <= 2 * QUEUED_ENTRIES_PER_JOB
+
+
 @pytest.mark.parametrize('sha,entries,fast', [
     (None, None, False),
     (None, None, True),
@@ -117,6 +172,7 @@ def test_main(sha, entries, fast):
             yes=False,
             show_all=True,
             fast=fast,
+            jobs=1,
         ))
         if not fast:
             assert mock_verify.call_count == 1
@@ -126,6 +182,7 @@ def test_main(sha, entries, fast):
                     entries,
                     backup_store,
                     True,
+                    1,
                 )]
         else:
             assert mock_fast_verify.call_count == 1
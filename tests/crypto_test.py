@@ -95,6 +95,21 @@ def test_compress_and_encrypt(caplog, mock_open_streams):
     hmac.verify(signature)
 
 
+@pytest.mark.parametrize('level', [0, 1, 9])
+def test_compress_and_encrypt_compression_level(mock_open_streams, level):
+    orig, new, _ = mock_open_streams
+    compress_and_encrypt(
+        orig,
+        new,
+        b'',
+        dict(use_compression=True, use_encryption=False, compression_level=level),
+    )
+
+    cobj = zlib.compressobj(level)
+    assert new._fd.getvalue() == cobj.compress(orig._fd.getvalue()) + cobj.flush()
+    assert zlib.decompress(new._fd.getvalue()) == orig._fd.getvalue()
+
+
 def test_decrypt_and_unpack_no_compression_no_encryption(caplog, mock_open_streams):
     orig, new, _ = mock_open_streams
     decrypt_and_unpack(orig, new, b'', dict(use_compression=False, use_encryption=False))
@@ -54,14 +54,16 @@ def test_context_manager_twice(mock_io_iter):
         pass
 
 
-def test_reader_not_open(mock_io_iter):
+@pytest.mark.parametrize('reader_name', ['reader', 'buffered_reader'])
+def test_reader_not_open(mock_io_iter, reader_name):
     with pytest.raises(BufferError):
-        next(mock_io_iter.reader())
+        next(getattr(mock_io_iter, reader_name)())
 
 
-def test_reader_contents(mock_io_iter, foo_contents):
+@pytest.mark.parametrize('reader_name', ['reader', 'buffered_reader'])
+def test_reader_contents(mock_io_iter, foo_contents, reader_name):
     with mock_io_iter:
-        for i, data in enumerate(mock_io_iter.reader()):
+        for i, data in enumerate(getattr(mock_io_iter, reader_name)()):
             start_pos = i * 2
             end_pos = start_pos + 2
             assert data == foo_contents[start_pos:end_pos]
@@ -133,6 +135,13 @@ def test_compute_sha(mock_io_iter, foo_contents):
     sha_fn.update(foo_contents)
     with mock_io_iter:
         assert compute_sha(mock_io_iter) == sha_fn.hexdigest()
+        assert mock_io_iter.fd.tell() == 0
+
+
+def test_compute_sha_file_changed(mock_io_iter, foo_contents):
+    with mock_io_iter, pytest.raises(FileChangedException):
+        mock_io_iter._enter_mtime -= 1
+        compute_sha(mock_io_iter)
 
 
 def test_copy(mock_io_iter, foo_contents):
@@ -140,3 +149,88 @@ def test_copy(mock_io_iter, foo_contents):
         io_copy(mock_io_iter, copy)
     with open('/bar', 'rb') as f:
         assert f.read() == foo_contents
+
+
+@pytest.mark.parametrize('copy_file_range_error,sendfile_error', [
+    (None, None),
+    (OSError, None),
+    (OSError, OSError),
+])
+@pytest.mark.parametrize('drop_cache_after_read', [True, False])
+def test_copy_real_files(tmp_path, copy_file_range_error, sendfile_error, drop_cache_after_read):
+    contents = b'asdfhjklqwerty'
+    (tmp_path / 'foo').write_bytes(contents)
+    with mock.patch(
+        'backuppy.io.os.copy_file_range',
+        wraps=os.copy_file_range,
+        side_effect=copy_file_range_error,
+    ) as mock_copy_file_range, \
+            mock.patch('backuppy.io.os.sendfile', wraps=os.sendfile, side_effect=sendfile_error) as mock_sendfile, \
+            IOIter(str(tmp_path / 'foo'), block_size=2) as orig, \
+            IOIter(str(tmp_path / 'bar'), block_size=2) as copy, \
+            mock.patch('backuppy.io.os.posix_fadvise') as mock_fadvise:
+        orig.drop_cache_after_read = drop_cache_after_read
+        sha = io_copy(orig, copy)
+        orig_fd = orig.fd.fileno()
+    assert mock_copy_file_range.call_count == 1
+    assert mock_sendfile.call_count == int(bool(copy_file_range_error))
+    # both the kernel copy and the fallback copy should drop the source's pages if asked to
+    assert any(
+        c[0][0] == orig_fd and c[0][3] == os.POSIX_FADV_DONTNEED
+        for c in mock_fadvise.call_args_list
+    ) == drop_cache_after_read
+    assert (tmp_path / 'bar').read_bytes() == contents
+    assert sha == sha256(contents).hexdigest()
+
+
+@pytest.mark.parametrize('sendfile_kwargs', [{'wraps': os.sendfile}, {'return_value': 0}])
+def test_copy_real_files_nothing_copied(tmp_path, sendfile_kwargs):
+    contents = b'asdfhjklqwerty'
+    (tmp_path / 'foo').write_bytes(contents)
+    with mock.patch('backuppy.io.os.copy_file_range', return_value=0), \
+            mock.patch('backuppy.io.os.sendfile', **sendfile_kwargs) as mock_sendfile, \
+            IOIter(str(tmp_path / 'foo'), block_size=2) as orig, \
+            IOIter(str(tmp_path / 'bar'), block_size=2) as copy:
+        sha = io_copy(orig, copy)
+    assert mock_sendfile.call_count == 1
+    assert (tmp_path / 'bar').read_bytes() == contents
+    assert sha == sha256(contents).hexdigest()
+
+
+def test_copy_real_files_short_copy(tmp_path):
+    (tmp_path / 'foo').write_bytes(b'asdfhjklqwerty')
+    with mock.patch('backuppy.io.os.copy_file_range', side_effect=[4, 0]), \
+            mock.patch('backuppy.io.os.sendfile') as mock_sendfile, \
+            IOIter(str(tmp_path / 'foo'), block_size=2) as orig, \
+            IOIter(str(tmp_path / 'bar'), block_size=2) as copy, \
+            pytest.raises(FileChangedException):
+        io_copy(orig, copy)
+    assert mock_sendfile.call_count == 0
+
+
+@pytest.mark.parametrize('reader', ['reader', 'buffered_reader'])
+@pytest.mark.parametrize('drop_cache_after_read', [True, False])
+def test_reader_drops_cache(tmp_path, reader, drop_cache_after_read):
+    (tmp_path / 'foo').write_bytes(b'asdfhjklqwerty')
+    with mock.patch('backuppy.io.os.posix_fadvise') as mock_fadvise, \
+            IOIter(str(tmp_path / 'foo'), block_size=5) as orig:
+        orig.drop_cache_after_read = drop_cache_after_read
+        for data in getattr(orig, reader)():
+            pass
+    fd = mock_fadvise.call_args_list[0][0][0]
+    assert mock_fadvise.call_args_list == [
+        mock.call(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL),
+    ] + ([
+        mock.call(fd, 0, 5, os.POSIX_FADV_DONTNEED),
+        mock.call(fd, 5, 5, os.POSIX_FADV_DONTNEED),
+        mock.call(fd, 10, 4, os.POSIX_FADV_DONTNEED),
+    ] if drop_cache_after_read else [])
+
+
+def test_drop_cache(tmp_path):
+    (tmp_path / 'foo').write_bytes(b'asdfhjklqwerty')
+    with mock.patch('backuppy.io.os.posix_fadvise') as mock_fadvise, \
+            IOIter(str(tmp_path / 'foo')) as orig:
+        orig.drop_cache()
+    fd = mock_fadvise.call_args_list[0][0][0]
+    assert mock_fadvise.call_args_list[-1] == mock.call(fd, 0, 0, os.POSIX_FADV_DONTNEED)
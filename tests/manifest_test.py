@@ -104,6 +104,15 @@ def test_get_entry_file_deleted(mock_manifest):
     assert not entry.mode
 
 
+def test_get_entry_same_timestamp(mock_manifest):
+    mock_manifest._cursor.execute(
+        "insert into manifest (abs_file_name, commit_timestamp) values ('/foo', 100)"
+    )
+    entry = mock_manifest.get_entry('/foo', 100)
+    assert entry.abs_file_name == '/foo'
+    assert not entry.sha
+
+
 def test_get_entries_by_sha(mock_manifest):
     entries = mock_manifest.get_entries_by_sha('1')
     assert len(entries) == 3
@@ -149,6 +158,30 @@ def test_search_history_limit(mock_manifest, limit):
         assert len(history) == 1
 
 
+@pytest.mark.parametrize('before_timestamp', [None, 75])
+def test_search_deleted_only(mock_manifest, before_timestamp):
+    results = mock_manifest.search(before_timestamp=before_timestamp, deleted_only=True)
+    if before_timestamp:
+        assert results == []
+    else:
+        assert [path for path, __ in results] == ['/baz']
+        assert len(results[0][1]) == 2
+
+
+@pytest.mark.parametrize('after_timestamp', [None, 60])
+def test_search_changed_only(mock_manifest, after_timestamp):
+    results = mock_manifest.search(after_timestamp=after_timestamp, changed_only=True)
+    if after_timestamp:
+        assert results == []
+    else:
+        assert [path for path, __ in results] == ['/bar', '/baz', '/foo']
+
+
+def test_search_deleted_and_changed_only(mock_manifest):
+    results = mock_manifest.search(deleted_only=True, changed_only=True)
+    assert [path for path, __ in results] == ['/baz']
+
+
 @pytest.mark.parametrize('base_sha,base_key_pair', [(None, None), ('f33b', b'2222')])
 def test_insert_new_file(mock_manifest, mock_stat, base_sha, base_key_pair):
     new_file = '/not/backed/up'
@@ -263,6 +296,13 @@ def test_delete(mock_manifest):
     assert rows[-1]['commit_timestamp'] == 1000
 
 
+def test_delete_many(mock_manifest):
+    with mock.patch.object(mock_manifest, '_commit', wraps=mock_manifest._commit) as mock_commit:
+        mock_manifest.delete_many(['/foo', '/not/backed/up', '/bar'])
+    assert mock_commit.call_count == 1
+    assert mock_manifest.files() == set()
+
+
 def test_delete_unknown(mock_manifest, caplog):
     with mock.patch('backuppy.manifest.logger') as mock_logger:
         mock_manifest.delete('/not/backed/up')
@@ -285,6 +325,10 @@ def test_tracked_files(mock_manifest, timestamp):
     assert mock_manifest.files(timestamp) == expected
 
 
+def test_tracked_files_exclude(mock_manifest):
+    assert mock_manifest.files(exclude={'/bar', '/not/backed/up'}) == {'/foo'}
+
+
 def test_find_duplicate_entries(mock_manifest):
     mock_manifest._cursor.execute('drop index mfst_unique_idx')
     mock_manifest._cursor.execute(
@@ -295,7 +339,11 @@ def test_find_duplicate_entries(mock_manifest):
         ('/foo', '12345678', 1000, 3000, 34622, '5678', 1000)
         '''
     )
-    assert len(mock_manifest.find_duplicate_entries()) == 2
+    entries = mock_manifest.find_duplicate_entries()
+    assert [(e.abs_file_name, e.uid, e.gid, e.commit_timestamp) for e in entries] == [
+        ('/foo', 1000, 2000, 1000),
+        ('/foo', 1000, 2000, 50),
+    ]
 
 
 def test_find_shas_with_multiple_key_pairs(mock_manifest):
@@ -1,5 +1,7 @@
+import errno
 import os
 import signal
+from contextlib import ExitStack
 
 import mock
 import pytest
@@ -14,6 +16,9 @@ from backuppy.stores.backup_store import _register_unlocked_store
 from backuppy.stores.backup_store import _SIGNALS_TO_HANDLE
 from backuppy.stores.backup_store import _unregister_store
 from backuppy.stores.backup_store import BackupStore
+from backuppy.stores.backup_store import MAX_MEMORY_STAGING_SIZE
+from backuppy.stores.backup_store import MIN_FREE_MEMORY_STAGING_SPACE
+from backuppy.stores.backup_store import SHA_LOCK_STRIPES
 from backuppy.util import get_scratch_dir
 
 
@@ -105,7 +110,7 @@ def test_unlock(fs, backup_store, manifest_exists):
         with backup_store.unlock():
             pass
         assert mock_unlock_manifest.call_count == manifest_exists
-        assert mock_remove.call_count == 1
+        assert mock_remove.call_count == 2
         assert backup_store.do_cleanup.call_args == mock.call(False, False)
         assert mock_register.call_count == 1
         assert mock_unregister.call_count == 1
@@ -176,7 +181,9 @@ def test_restore_entry(backup_store, base_sha, current_entry):
     if base_sha:
         current_entry.base_key_pair = b'2222'
         orig_file, diff_file, restore_file = mock.MagicMock(), mock.MagicMock(), mock.MagicMock()
-        backup_store.restore_entry(current_entry, orig_file, diff_file, restore_file)
+        with mock.patch('backuppy.stores.backup_store.apply_diff') as mock_apply_diff:
+            backup_store.restore_entry(current_entry, orig_file, diff_file, restore_file)
+        assert mock_apply_diff.call_args == mock.call(orig_file, diff_file, restore_file)
         if base_sha:
             assert backup_store.load.call_args_list[0] == mock.call(base_sha, orig_file, b'2222')
         assert backup_store.load.call_args_list[-1] == mock.call(
@@ -187,12 +194,18 @@ def test_restore_entry(backup_store, base_sha, current_entry):
 
 
 @pytest.mark.no_mocksaveload
-def test_save(backup_store):
-    expected_path = '/tmp/backuppy/12/34/5678'
+@pytest.mark.parametrize('size,free_space,expected_path', [
+    (10, 1 << 30, '/dev/shm/backuppy/12/34/5678'),
+    (10, MIN_FREE_MEMORY_STAGING_SPACE, '/tmp/backuppy/12/34/5678'),
+    (MAX_MEMORY_STAGING_SIZE + 1, 1 << 30, '/tmp/backuppy/12/34/5678'),
+])
+def test_save(backup_store, size, free_space, expected_path):
     with mock.patch('backuppy.stores.backup_store.IOIter') as mock_io_iter, \
             mock.patch('backuppy.stores.backup_store.compress_and_encrypt') as mock_compress, \
-            mock.patch('backuppy.stores.backup_store.os.remove') as mock_remove:
-        backup_store.save(mock.Mock(), '12345678', b'1111')
+            mock.patch('backuppy.stores.backup_store.os.remove') as mock_remove, \
+            mock.patch('backuppy.stores.backup_store.disk_usage', return_value=mock.Mock(free=free_space)), \
+            mock.patch('backuppy.util.os.path.isdir', return_value=True):
+        backup_store.save(mock.Mock(size=size), '12345678', b'1111')
         src = mock_io_iter.return_value.__enter__.return_value
         assert mock_compress.call_count == 1
         assert mock_io_iter.call_args[0][0] == expected_path
@@ -200,6 +213,33 @@ def test_save(backup_store):
         assert mock_remove.call_count == 1
 
 
+@pytest.mark.no_mocksaveload
+@pytest.mark.parametrize('err', [errno.ENOSPC, errno.EIO])
+def test_save_memory_staging_full(backup_store, err):
+    with mock.patch('backuppy.stores.backup_store.IOIter') as mock_io_iter, \
+            mock.patch('backuppy.stores.backup_store.compress_and_encrypt') as mock_compress, \
+            mock.patch('backuppy.stores.backup_store.os.remove') as mock_remove, \
+            mock.patch('backuppy.stores.backup_store.disk_usage', return_value=mock.Mock(free=1 << 30)), \
+            mock.patch('backuppy.util.os.path.isdir', return_value=True):
+        mock_compress.side_effect = [OSError(err, 'oops'), b'']
+        with (pytest.raises(OSError) if err != errno.ENOSPC else ExitStack()):
+            backup_store.save(mock.Mock(size=10), '12345678', b'1111')
+
+        if err == errno.ENOSPC:
+            assert [c[0][0] for c in mock_io_iter.call_args_list] == [
+                '/dev/shm/backuppy/12/34/5678',
+                '/tmp/backuppy/12/34/5678',
+            ]
+            assert mock_remove.call_args_list == [
+                mock.call('/dev/shm/backuppy/12/34/5678'),
+                mock.call('/tmp/backuppy/12/34/5678'),
+            ]
+            assert backup_store._save.call_count == 1
+        else:
+            assert mock_io_iter.call_count == 1
+            assert backup_store._save.call_count == 0
+
+
 @pytest.mark.no_mocksaveload
 def test_load(backup_store):
     with mock.patch('backuppy.stores.backup_store.IOIter') as mock_io_iter, \
@@ -244,15 +284,17 @@ def test_do_cleanup(fs, backup_store, manifest, dry_run, preserve_scratch):
         assert backup_store.rotate_manifests.call_count == int(bool(
             manifest and manifest.changed and not dry_run
         ))
-        assert mock_remove.call_count == int(bool(manifest and not preserve_scratch))
+        assert mock_remove.call_count == 2 * int(bool(manifest and not preserve_scratch))
         assert backup_store._manifest is None
 
 
 @pytest.mark.parametrize('dry_run', [True, False])
 def test_write_copy(backup_store, dry_run, caplog):
     with mock.patch('backuppy.stores.backup_store.generate_key_pair', return_value=b'11111'):
-        entry = backup_store._write_copy('/foo', '12345678', mock.MagicMock(), False, dry_run)
+        file_obj = mock.MagicMock()
+        entry = backup_store._write_copy('/foo', '12345678', file_obj, False, dry_run)
     assert entry.sha == '12345678'
+    assert (file_obj.drop_cache_after_read is True) == (not dry_run)
     # no signature computed in dry-run mode
     assert entry.key_pair == b'111112222' if not dry_run else b'11111'
     assert backup_store.save.call_count == int(not dry_run)
@@ -286,14 +328,16 @@ def test_write_diff(backup_store, current_entry, base_sha, dry_run, caplog):
     with mock.patch('backuppy.stores.backup_store.generate_key_pair', return_value=b'11111'), \
             mock.patch('backuppy.stores.backup_store.compute_diff') as mock_compute_diff:
         mock_compute_diff.return_value = ('12345678', mock.Mock())
+        file_obj = mock.MagicMock()
         entry = backup_store._write_diff(
             '/foo',
             '12345678',
             current_entry,
-            mock.MagicMock(),
+            file_obj,
             dry_run,
         )
     assert entry.sha == '12345678'
+    assert file_obj.drop_cache.call_count == 1
     assert entry.base_sha == ('321fedcba' if base_sha else 'abcdef123')
     # no signature computed in dry-run mode
     assert entry.key_pair == b'111112222' if not dry_run else b'11111'
@@ -307,14 +351,16 @@ def test_write_diff_too_big(backup_store, current_entry, dry_run, caplog):
     with mock.patch('backuppy.stores.backup_store.generate_key_pair', return_value=b'11111'), \
             mock.patch('backuppy.stores.backup_store.compute_diff') as mock_compute_diff:
         mock_compute_diff.side_effect = DiffTooLargeException
+        file_obj = mock.MagicMock()
         entry = backup_store._write_diff(
             '/foo',
             '12345678',
             current_entry,
-            mock.MagicMock(),
+            file_obj,
             dry_run,
         )
     assert entry.sha == '12345678'
+    assert file_obj.drop_cache.call_count == 0
     assert entry.base_sha is None
     # no signature computed in dry-run mode
     assert entry.key_pair == b'111112222' if not dry_run else b'11111'
@@ -386,3 +432,8 @@ def test_unregister_store():
         mock.call(sig, signal.SIG_DFL)
         for sig in _SIGNALS_TO_HANDLE
     ]
+
+
+def test_lock_sha(backup_store):
+    assert backup_store._lock_sha('abcdef12' * 8) is backup_store._lock_sha('abcdef12' * 8)
+    assert len({id(backup_store._lock_sha(f'{i:064x}')) for i in range(1000)}) == SHA_LOCK_STRIPES
@@ -36,6 +36,17 @@ def test_save(caplog, mock_backup_store):
         assert f.read() == "i'm a copy of bar"
 
 
+def test_save_staged(mock_backup_store):
+    staged_filename = mock_backup_store._staging_filename('/asdf/bar')
+    with IOIter(staged_filename) as input1:
+        input1.fd.write(b'some staged data')
+        input1.fd.flush()
+        mock_backup_store._save(input1, '/asdf/bar')
+    assert not os.path.exists(staged_filename)
+    with open('/fake/path/fake_backup/asdf/bar', 'r') as f:
+        assert f.read() == 'some staged data'
+
+
 def test_load(mock_backup_store):
     with IOIter('/restored_file') as output:
         mock_backup_store._load('/foo', output)
@@ -47,6 +58,11 @@ def test_query(mock_backup_store):
     assert set(mock_backup_store._query('')) == {'/biz/baz', '/foo', '/fuzz/buzz'}
 
 
+def test_query_skips_staged_files(fs, mock_backup_store):
+    fs.create_file('/fake/path/fake_backup/.staging/foo')
+    assert set(mock_backup_store._query('')) == {'/biz/baz', '/foo', '/fuzz/buzz'}
+
+
 def test_query_2(mock_backup_store):
     assert set(mock_backup_store._query('f')) == {'/foo', '/fuzz/buzz'}
 
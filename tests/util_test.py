@@ -1,5 +1,7 @@
 import re
 
+import mock
+
 from backuppy.util import file_walker
 
 
@@ -15,3 +17,26 @@ def test_file_walker(fs):
     fs.create_file('/fizz/skip2')
     results = {f for f in file_walker('/', exclusions=[re.compile('skip')])}
     assert results == {'/foo', '/bar', '/fizz/buzz'}
+
+
+def test_file_walker_uncombinable_exclusions(fs):
+    fs.create_file('/foo')
+    fs.create_file('/SKIP/baz')
+    fs.create_file('/fizz/aa')
+    fs.create_file('/fizz/ab')
+    results = {f for f in file_walker('/', exclusions=[re.compile('(?i)skip'), re.compile(r'(a)\1')])}
+    assert results == {'/foo', '/fizz/ab'}
+
+
+def test_file_walker_symlinks(fs):
+    fs.create_file('/foo/bar')
+    fs.create_symlink('/baz', '/foo')
+    fs.create_symlink('/fizz', '/foo/bar')
+    results = {f for f in file_walker('/')}
+    assert results == {'/foo/bar', '/fizz'}
+
+
+def test_file_walker_error(fs):
+    on_error = mock.Mock()
+    assert list(file_walker('/does/not/exist', on_error=on_error)) == []
+    assert isinstance(on_error.call_args[0][0], FileNotFoundError)